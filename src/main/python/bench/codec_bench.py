@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+json编解码的基准：编码`DBUtil.query`风格的大`result`数组。
+
+在`src/main/python`目录下运行：
+
+```
+python -m bench.codec_bench
+```
+"""
+import datetime
+import decimal
+import json
+import timeit
+
+from core.codec import get_codec
+
+__author__ = 'cuigang@easted.com.cn'
+
+
+def make_rows(n, plain=False):
+    """
+    模拟`DictCursor`返回的行
+
+    :param plain: 没有`datetime`和`Decimal`列
+    """
+    now = datetime.datetime(2017, 6, 21, 10, 30, 0)
+    if plain:
+        return [{
+            'id': i,
+            'name': u'vm-%d' % i,
+            'status': 'active',
+            'cpu': 4,
+            'memory': 8192,
+            'created_at': '2017-06-21 10:30:00',
+            'remark': None,
+        } for i in range(n)]
+    return [{
+        'id': i,
+        'name': u'vm-%d' % i,
+        'status': 'active',
+        'cpu': 4,
+        'memory': decimal.Decimal('8192.00'),
+        'created_at': now,
+        'remark': None,
+    } for i in range(n)]
+
+
+def main():
+    codecs = []
+    for name in ('json', 'simplejson', 'ujson', 'orjson'):
+        try:
+            codecs.append(get_codec(name))
+        except ImportError:
+            print('%s is not installed, skipped' % name)
+
+    # 各实现的输出必须一致，Decimal不能损失精度
+    sample = {"result": make_rows(2)}
+    sample['result'][0]['memory'] = decimal.Decimal('0.1000000000000000055')
+    expected = json.loads(codecs[0].dumps(sample), parse_float=decimal.Decimal)
+    for c in codecs:
+        assert json.loads(c.dumps(sample),
+                          parse_float=decimal.Decimal) == expected, c.name
+
+    for plain in (False, True):
+        print('')
+        print('without datetime/Decimal' if plain else 'with datetime/Decimal')
+        bench(codecs, plain)
+
+
+def bench(codecs, plain):
+    print('%8s' % 'rows' + ''.join('%14s' % c.name for c in codecs))
+    for n in (100, 1000, 10000, 50000):
+        res = {
+            "success": True,
+            "msg": "",
+            "result": make_rows(n, plain),
+            "total": n
+        }
+        number = max(1, 20000 // n)
+        line = '%8d' % n
+        for c in codecs:
+            # 重复5次取最短的时间，减少其他进程的干扰
+            t = min(timeit.repeat(lambda: c.dumps(res), number=number,
+                                  repeat=5))
+            line += '%12.2fms' % (t / number * 1000)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""
+executor的基准：同时执行CPU密集的操作时，IOLoop的最大延迟（lag）和总耗时。
+
+- inline：直接在IOLoop中执行；
+- thread：`executor='thread'`，python代码受GIL限制，但IOLoop可以在调用之间运行；
+- process：`executor='process'`。
+
+在`src/main/python`目录下运行：
+
+```
+python -m bench.executor_bench
+```
+"""
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from core import executor
+from core.executor import Offload
+
+__author__ = 'cuigang@easted.com.cn'
+
+CALLS = 16
+WORK = 300000
+
+
+class Service(object):
+    def work(self, n):
+        return sum(i * i for i in xrange(n))
+
+    work._func = work
+
+
+@gen.coroutine
+def inline(handler, n):
+    # 每个调用在自己的回调中执行，和处理请求一样
+    yield gen.moment
+    raise gen.Return(handler.work(n))
+
+
+@gen.coroutine
+def run(name, call):
+    io_loop = IOLoop.current()
+    lags = [0.0]
+    state = {'running': True}
+
+    def beat(expected):
+        lags.append(io_loop.time() - expected)
+        if state['running']:
+            io_loop.call_later(0.01, beat, io_loop.time() + 0.01)
+
+    # 预先创建线程/进程
+    yield call(Service(), 1)
+    beat(io_loop.time())
+    start = time.time()
+    yield [call(Service(), WORK) for i in range(CALLS)]
+    elapsed = time.time() - start
+    yield gen.sleep(0.02)
+    state['running'] = False
+    print('%-10s total %6.3fs  max loop lag %6.3fs' % (
+        name, elapsed, max(lags)))
+
+
+@gen.coroutine
+def main():
+    yield run('inline', inline)
+    yield run('thread', Offload(Service.work.im_func, 'thread', 'thread'))
+    yield run('process', Offload(Service.work.im_func, 'process', 'process'))
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    IOLoop.current().run_sync(main)
@@ -0,0 +1,103 @@
+# coding=utf-8
+"""
+日志写入的基准：
+
+- `core.logger_handler.TimedRotatingFileHandler`各模式每秒写入的记录数；
+- 每个请求的日志开销：标准库logger和`core.fastlog`分别写一个请求的SQL日志的耗时。
+
+在`src/main/python`目录下运行：
+
+```
+python -m bench.log_bench
+```
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from core import fastlog
+from core.logger_base import system_log_format
+from core.logger_handler import TimedRotatingFileHandler
+
+__author__ = 'cuigang@easted.com.cn'
+
+RECORDS = 100000
+
+REQUESTS = 20000
+
+# 一个请求执行的SQL
+STATEMENTS = [
+    ('select * from vm where id = %s', (1,)),
+    ('select * from vm_tag where vm_id = %s', (1,)),
+    ('update vm set status = %s where id = %s', ('active', 1)),
+    ('insert into vm_log (vm_id, msg) values (%s, %s)', (1, 'started')),
+]
+
+
+def run(name, handler):
+    """ 只测量handler本身：格式化、滚动检查和写入 """
+    handler.setFormatter(logging.Formatter(system_log_format))
+    record = logging.LogRecord(
+        'system', logging.INFO, __file__, 1, '%s %s',
+        ('select * from vm where id = %s', (1,)), None)
+    start = time.time()
+    for i in range(RECORDS):
+        handler.handle(record)
+    handler.close()
+    elapsed = time.time() - start
+    print('%-24s %10.0f records/s' % (name, RECORDS / elapsed))
+
+
+def run_request(name, log, handler, formatter, level=logging.INFO,
+                limit=None):
+    """ 测量一个请求写SQL日志的耗时，包括创建记录、过滤、格式化和写入 """
+    logger = logging.getLogger('bench')
+    logger.handlers = [handler]
+    logger.filters = [limit] if limit is not None else []
+    logger.propagate = False
+    logger.setLevel(level)
+    handler.setFormatter(formatter)
+    start = time.time()
+    for i in range(REQUESTS):
+        for sql, args in STATEMENTS:
+            log.info('%s %s', sql, args)
+    elapsed = time.time() - start
+    handler.close()
+    print('%-32s %8.1f us/request' % (name, elapsed / REQUESTS * 1e6))
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        run('unbuffered', TimedRotatingFileHandler(
+            os.path.join(tmp, 'unbuffered.log'), when='midnight',
+            backupCount=3650))
+        run('buffered 64KB', TimedRotatingFileHandler(
+            os.path.join(tmp, 'buffered.log'), when='midnight',
+            backupCount=3650, bufferSize=64 * 1024))
+
+        def handler():
+            return TimedRotatingFileHandler(
+                os.path.join(tmp, 'request.log'), when='midnight',
+                backupCount=3650, bufferSize=64 * 1024)
+
+        stdlib = logging.getLogger('bench')
+        fast = fastlog.getLogger('bench')
+        compiled = fastlog.CompiledFormatter(system_log_format)
+        run_request('logging', stdlib, handler(),
+                    logging.Formatter(system_log_format))
+        run_request('fastlog', fast, handler(), compiled)
+        run_request('fastlog, sample 0.1', fast, handler(), compiled,
+                    limit=fastlog.RateLimitFilter(sample=0.1))
+        run_request('logging, level WARNING', stdlib, handler(),
+                    logging.Formatter(system_log_format), logging.WARNING)
+        run_request('fastlog, level WARNING', fast, handler(), compiled,
+                    logging.WARNING)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# coding=utf-8
+"""
+参数提取的微基准：对比原先的`_find_params_value_of_arguments`（之后在方法中手工转换类型）
+和`params`编译的`Binder`（同时完成类型转换和检查）。
+
+在`src/main/python`目录下运行：
+
+```
+python -m bench.params_bench
+```
+"""
+import timeit
+
+from core.params import Binder, Bool, Enum, Int, Str
+from core.rest import get
+
+__author__ = 'cuigang@easted.com.cn'
+
+SCHEMA = {
+    'id': Int(min=1),
+    'limit': Int(default=20, min=1, max=1000),
+    'offset': Int(default=0, min=0),
+    'state': Enum('running', 'stopped'),
+    'name': Str(max_len=64),
+    'detail': Bool(default=False),
+}
+
+
+def show(self, id, limit, offset, state, name, detail):
+    pass
+
+
+def legacy_extract(operation, url_values, arguments):
+    """ 原先`_find_params_value_of_arguments`的逻辑 """
+    values = []
+    if len(arguments) > 0:
+        a = operation._service_params
+        b = operation._func_params
+        params = [item for item in b if item not in a]
+        for p in params:
+            if p in arguments.keys():
+                v = arguments[p]
+                values.append(v[0])
+            else:
+                values.append(None)
+    elif len(arguments) == 0 and len(operation._query_params) > 0:
+        values = [None] * (
+            len(operation._func_params) - len(operation._service_params))
+    return url_values + values
+
+
+def legacy_convert(operation, url_values, arguments):
+    """ 原先的提取，加上方法中手工的转换和检查 """
+    id, limit, offset, state, name, detail = legacy_extract(
+        operation, url_values, arguments)
+    id = int(id)
+    if id < 1:
+        raise ValueError('id')
+    limit = int(limit) if limit is not None else 20
+    if not 1 <= limit <= 1000:
+        raise ValueError('limit')
+    offset = int(offset) if offset is not None else 0
+    if offset < 0:
+        raise ValueError('offset')
+    if state is not None and state not in ('running', 'stopped'):
+        raise ValueError('state')
+    if name is not None:
+        name = name.decode('utf-8')
+        if len(name) > 64:
+            raise ValueError('name')
+    detail = detail is not None and detail.lower() in ('1', 'true')
+    return [id, limit, offset, state, name, detail]
+
+
+def best(fn, number):
+    """ 重复5次取最短的时间，减少其他进程的干扰 """
+    return min(timeit.repeat(fn, number=number, repeat=5))
+
+
+def main():
+    number = 20000
+    path = '/vm/{id}?<limit>&<offset>&<state>&<name>&<detail>'
+    operation = get(_path=path)(show)
+    binder = Binder(show, operation._service_params, SCHEMA)
+    cases = [
+        ('no query', {}),
+        ('2 args', {'limit': ['50'], 'state': ['running']}),
+        ('5 args', {'limit': ['50'], 'offset': ['100'], 'state': ['running'],
+                    'name': ['web-01'], 'detail': ['true']}),
+        ('5 args+10', dict(
+            [('x%d' % i, ['1']) for i in range(10)],
+            limit=['50'], offset=['100'], state=['running'],
+            name=['web-01'], detail=['true'])),
+    ]
+    print '%10s %12s %14s %12s %8s' % (
+        'query', 'extract', 'extract+conv', 'binder', 'speedup')
+    for label, arguments in cases:
+        url_values = ['42']
+        assert binder.bind(url_values, arguments) == legacy_convert(
+            operation, url_values, arguments)
+        extract = best(
+            lambda: legacy_extract(operation, url_values, arguments), number)
+        convert = best(
+            lambda: legacy_convert(operation, url_values, arguments), number)
+        bind = best(lambda: binder.bind(url_values, arguments), number)
+        print '%10s %10.2fus %12.2fus %10.2fus %7.1fx' % (
+            label,
+            extract / number * 1e6,
+            convert / number * 1e6,
+            bind / number * 1e6,
+            convert / bind)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+路由查找的微基准：对比原先`_exe`中对`dir(self)`的线性扫描和`RouteTable`。
+
+在`src/main/python`目录下运行：
+
+```
+python -m bench.route_bench
+```
+"""
+import inspect
+import timeit
+
+from tornado.httputil import HTTPServerRequest
+from tornado.web import Application
+
+from core.rest import get, post, RestHandler
+
+__author__ = 'cuigang@easted.com.cn'
+
+
+def make_service(n):
+    """ 生成一个有n个GET和n个POST操作的RestHandler子类 """
+    attrs = {}
+    for i in range(n):
+        attrs['list_%d' % i] = get(_path='/res%d/list' % i)(
+            lambda self: None)
+        attrs['show_%d' % i] = get(_path='/res%d/{id}' % i)(
+            lambda self, id: None)
+        attrs['create_%d' % i] = post(_path='/res%d' % i)(
+            lambda self: None)
+    return type('BenchService%d' % n, (RestHandler,), attrs)
+
+
+class _Connection(object):
+    def set_close_callback(self, callback):
+        pass
+
+
+def make_handler(cls, method, request_path):
+    """ 不经过HTTPServer，直接构造handler实例 """
+    request = HTTPServerRequest(method, request_path, connection=_Connection())
+    return cls(Application(), request)
+
+
+def legacy_lookup(handler, method, request_path):
+    """ 原先`_exe`中的查找逻辑 """
+    path = request_path.split('/')
+    services_and_params = list(filter(lambda x: x != '', path))
+    functions = list(filter(
+        lambda op: hasattr(
+            getattr(handler, op),
+            '_service_name'
+        ) is True and inspect.ismethod(
+            getattr(handler, op)
+        ) is True, dir(handler)))
+    list(map(lambda op: getattr(getattr(handler, op), '_method'), functions))
+    for operation in list(map(lambda op: getattr(handler, op), functions)):
+        service_name = getattr(operation, "_service_name")
+        service_params = getattr(operation, "_service_params")
+        services_from_request = list(
+            filter(lambda x: x in path, service_name))
+        if operation._method == method and \
+                service_name == services_from_request and \
+                len(service_params) + len(service_name) == len(
+                    services_and_params):
+            return operation
+    return None
+
+
+def route_lookup(handler, method, request_path):
+    found = handler.route_table().match(method, request_path)
+    return getattr(handler, found[0])
+
+
+def main():
+    number = 2000
+    print '%8s %14s %14s %8s' % ('routes', 'dir() scan', 'route table', 'speedup')
+    for n in (1, 5, 10, 25, 50, 100):
+        cls = make_service(n)
+        request_path = '/res%d/42' % (n - 1)
+        handler = make_handler(cls, 'GET', request_path)
+        assert legacy_lookup(handler, 'GET', request_path)._path == \
+            route_lookup(handler, 'GET', request_path)._path
+        legacy = timeit.timeit(
+            lambda: legacy_lookup(handler, 'GET', request_path),
+            number=number)
+        table = timeit.timeit(
+            lambda: route_lookup(handler, 'GET', request_path),
+            number=number)
+        print '%8d %12.2fus %12.2fus %7.1fx' % (
+            n * 3,
+            legacy / number * 1e6,
+            table / number * 1e6,
+            legacy / table)
+
+
+if __name__ == '__main__':
+    main()
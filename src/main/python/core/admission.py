@@ -0,0 +1,382 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块限制每个操作的请求速率和并发数，超过时立即拒绝，不占用IOLoop和数据库连接。
+
+```python
+class Service(RestHandler):
+    @gen.coroutine
+    @get(_path='/report/{id}', rate_limit=(5, 10), max_in_flight=4, max_queue=20)
+    def report(self, id):
+        ...
+```
+
+- `rate_limit`：每个客户端的令牌桶，`(每秒的请求数, 突发的请求数)`，只给一个数时
+  突发数和速率相同；超过时返回429；
+- `rate_key`：取得客户端标识的函数，参数是request，默认是`remote_ip`；
+- `max_in_flight`：这个操作在每个进程中同时处理的请求数；
+- `max_queue`：超过`max_in_flight`时最多等待的请求数，默认0，队列满时返回503；
+- `queue_timeout`：在队列中最多等待的秒数，默认1秒，超时返回503。
+
+拒绝时响应头中带有`Retry-After`（秒）。
+
+令牌桶默认保存在进程的内存中，多进程运行时每个worker单独计数。
+通过`configure(RedisBackend(...))`可以在多个worker之间共享，
+Redis不可用时暂时使用内存中的令牌桶。
+
+"""
+import collections
+import functools
+import hashlib
+import logging
+import math
+import time
+
+from tornado import gen
+from tornado.concurrent import Future, is_future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.web import HTTPError
+
+from core import metrics
+
+__author__ = 'cuigang@easted.com.cn'
+
+LOG = logging.getLogger('system')
+
+_rejected = metrics.counter(
+    'rest_admission_rejected_total',
+    'Requests rejected by admission control, by reason: rate_limit (429), '
+    'queue_full or queue_timeout (503).',
+    ('route', 'reason'))
+_queued = metrics.gauge(
+    'rest_admission_queued',
+    'Requests waiting for a max_in_flight slot.', ('route',))
+_queue_seconds = metrics.histogram(
+    'rest_admission_queue_seconds',
+    'Time admitted requests waited for a max_in_flight slot.', ('route',))
+
+
+class Rejected(HTTPError):
+    """
+    :param retry_after: 建议客户端重试前等待的秒数
+    """
+
+    def __init__(self, status_code, reason, retry_after):
+        super(Rejected, self).__init__(status_code, reason)
+        self.reason = reason
+        self.retry_after = int(math.ceil(retry_after)) or 1
+
+    def __str__(self):
+        if self.status_code == 429:
+            return 'Too many requests, retry after %ds' % self.retry_after
+        return 'Service busy, retry after %ds' % self.retry_after
+
+
+class MemoryBackend(object):
+    """
+    在进程的内存中保存令牌桶。
+
+    :param max_keys: 超过时清理已经恢复满的桶
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    def take(self, key, rate, burst):
+        """
+        :return: (是否允许, 需要等待的秒数)
+        """
+        now = time.time()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self._sweep(now)
+            bucket = self.buckets[key] = [burst, now]
+            tokens = burst
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True, 0
+        bucket[0] = tokens
+        return False, (1 - tokens) / rate
+
+    def _sweep(self, now):
+        # 桶在burst/rate秒内就会恢复满，这里保守地按1分钟清理
+        for key, bucket in self.buckets.items():
+            if now - bucket[1] > 60:
+                del self.buckets[key]
+
+
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(b[1])
+if tokens == nil then
+  tokens = burst
+else
+  tokens = math.min(burst, tokens + math.max(0, now - tonumber(b[2])) * rate)
+end
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HMSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+if allowed == 1 then
+  return {1, '0'}
+end
+return {0, tostring((1 - tokens) / rate)}
+"""
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(object):
+    """
+    在Redis中保存令牌桶，多个worker共享，通过lua脚本保证原子性。
+    不依赖其他的库，使用一个连接，请求按顺序发送，回复按顺序读取。
+
+    Redis出错或者超时时，`retry_interval`秒内使用进程内存中的令牌桶。
+
+    :param prefix: key的前缀
+    :param timeout: 等待回复的秒数
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, prefix='ratelimit:',
+                 timeout=0.2, retry_interval=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.fallback = MemoryBackend()
+        self._retry_at = 0
+        self.sha = hashlib.sha1(_TAKE_SCRIPT).hexdigest()
+        self._stream = None
+        self._connecting = None
+        self._waiting = collections.deque()
+
+    @gen.coroutine
+    def _connect(self):
+        if self._stream is not None:
+            raise gen.Return(self._stream)
+        if self._connecting is None:
+            self._connecting = self._open()
+        try:
+            stream = yield self._connecting
+        finally:
+            self._connecting = None
+        raise gen.Return(stream)
+
+    @gen.coroutine
+    def _open(self):
+        stream = yield TCPClient().connect(self.host, self.port)
+        stream.set_close_callback(functools.partial(self._closed, stream))
+        self._stream = stream
+        IOLoop.current().spawn_callback(self._read_replies, stream)
+        if self.db:
+            yield self.command('SELECT', self.db)
+        raise gen.Return(stream)
+
+    def _closed(self, stream, reason='Connection closed'):
+        if self._stream is not stream:
+            # 已经处理过，或者是之前的连接
+            return
+        self._stream = None
+        waiting, self._waiting = self._waiting, collections.deque()
+        for future in waiting:
+            if not future.done():
+                future.set_exception(RedisError(reason))
+
+    @gen.coroutine
+    def _read_replies(self, stream):
+        try:
+            while True:
+                reply = yield self._read_reply(stream)
+                future = self._waiting.popleft()
+                if isinstance(reply, RedisError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except StreamClosedError:
+            pass
+        except Exception as e:
+            # 回复和请求已经对应不上，只能断开，之后的命令重新连接
+            LOG.warn('Bad reply from Redis, reconnect: %s', e)
+            self._closed(stream, str(e) if isinstance(e, RedisError) else
+                         'Bad reply: %s' % e)
+            stream.close()
+
+    @gen.coroutine
+    def _read_reply(self, stream):
+        line = yield stream.read_until(b'\r\n')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            raise gen.Return(rest)
+        if kind == b'-':
+            raise gen.Return(RedisError(rest))
+        if kind == b':':
+            raise gen.Return(int(rest))
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                raise gen.Return(None)
+            data = yield stream.read_bytes(size + 2)
+            raise gen.Return(data[:-2])
+        if kind == b'*':
+            rs = []
+            for i in range(int(rest)):
+                item = yield self._read_reply(stream)
+                rs.append(item)
+            raise gen.Return(rs)
+        raise RedisError('Bad reply: %r' % line)
+
+    @gen.coroutine
+    def command(self, *args):
+        stream = yield self._connect()
+        parts = [b'*%d\r\n' % len(args)]
+        for a in args:
+            a = a if isinstance(a, bytes) else str(a)
+            parts.append(b'$%d\r\n%s\r\n' % (len(a), a))
+        future = Future()
+        self._waiting.append(future)
+        stream.write(b''.join(parts))
+        rs = yield future
+        raise gen.Return(rs)
+
+    @gen.coroutine
+    def _eval(self, key, rate, burst):
+        args = (1, self.prefix + key, repr(float(rate)), repr(float(burst)),
+                repr(time.time()))
+        try:
+            rs = yield self.command('EVALSHA', self.sha, *args)
+        except RedisError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            rs = yield self.command('EVAL', _TAKE_SCRIPT, *args)
+        raise gen.Return(rs)
+
+    def take(self, key, rate, burst):
+        if time.time() < self._retry_at:
+            return self.fallback.take(key, rate, burst)
+        return self._take(key, rate, burst)
+
+    @gen.coroutine
+    def _take(self, key, rate, burst):
+        try:
+            allowed, wait = yield gen.with_timeout(
+                IOLoop.current().time() + self.timeout,
+                self._eval(key, rate, burst))
+        except Exception as e:
+            LOG.warn('Redis rate limit failed, use memory for %ds: %s',
+                     self.retry_interval, e)
+            self._retry_at = time.time() + self.retry_interval
+            raise gen.Return(self.fallback.take(key, rate, burst))
+        raise gen.Return((allowed == 1, float(wait)))
+
+
+_backend = MemoryBackend()
+
+
+def configure(backend):
+    """
+    :param backend: `MemoryBackend`或者`RedisBackend`
+    """
+    global _backend
+    _backend = backend
+
+
+def remote_ip(request):
+    return request.remote_ip
+
+
+class Admission(object):
+    """
+    由`core.rest.config`创建，一个操作的速率和并发限制。
+    """
+
+    def __init__(self, route, rate_limit=None, rate_key=None,
+                 max_in_flight=None, max_queue=0, queue_timeout=1.0):
+        self.route = route
+        self.rate = self.burst = None
+        if rate_limit is not None:
+            if isinstance(rate_limit, (tuple, list)):
+                self.rate, self.burst = rate_limit
+            else:
+                self.rate = self.burst = rate_limit
+            if self.rate <= 0 or self.burst < 1:
+                raise ValueError('Bad rate_limit: %r' % (rate_limit,))
+        self.rate_key = rate_key or remote_ip
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._queue = collections.deque()
+        self._queued = _queued.labels(route)
+        self._queue_seconds = _queue_seconds.labels(route)
+
+    def _reject(self, status_code, reason, retry_after):
+        _rejected.labels(self.route, reason).inc()
+        return Rejected(status_code, reason, retry_after)
+
+    @gen.coroutine
+    def admit(self, request):
+        """
+        通过时返回，之后必须调用`release`；不通过时抛出`Rejected`。
+        """
+        if self.rate is not None:
+            key = '%s|%s' % (self.route, self.rate_key(request))
+            rs = _backend.take(key, self.rate, self.burst)
+            if is_future(rs):
+                rs = yield rs
+            allowed, wait = rs
+            if not allowed:
+                raise self._reject(429, 'rate_limit', wait)
+        if self.max_in_flight is None:
+            return
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return
+        if len(self._queue) >= self.max_queue:
+            raise self._reject(503, 'queue_full', self.queue_timeout)
+        future = Future()
+        self._queue.append(future)
+        self._queued.inc()
+        start = time.time()
+        try:
+            yield gen.with_timeout(
+                IOLoop.current().time() + self.queue_timeout, future)
+        except gen.TimeoutError:
+            if future.done():
+                # 超时的同时得到了位置，交给下一个请求
+                self.release()
+            else:
+                self._queue.remove(future)
+            raise self._reject(503, 'queue_timeout', self.queue_timeout)
+        finally:
+            self._queued.dec()
+        # release已经把位置交给了这个请求，in_flight不变
+        self._queue_seconds.observe(time.time() - start)
+
+    def release(self):
+        if self.max_in_flight is None:
+            return
+        while self._queue:
+            future = self._queue.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
@@ -20,6 +20,16 @@ class ECloudException(Exception):
         return self.args[0]
 
 
+class ServiceBusy(ECloudException):
+    """
+    暂时过载，客户端可以稍后重试。`core.rest`响应`code`（503）和`Retry-After`，
+    不写异常堆栈。
+    """
+    msg = "The service is busy."
+    code = 503
+    retry_after = 1
+
+
 class ToDict(object):
     __metaclass__ = abc.ABCMeta
 
@@ -0,0 +1,217 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供`RestService`的`/batch`接口，一个http请求中执行多个操作。
+
+```
+POST /batch
+[
+    {"method": "GET", "path": "/vm/1"},
+    {"method": "GET", "path": "/vm", "args": {"limit": 20, "state": "running"}},
+    {"method": "POST", "path": "/vm", "body": {"name": "web-01"}}
+]
+```
+
+响应的`result`按顺序是每个操作的响应，和单独请求时相同，另外有`status`（状态码）：
+
+```
+{"success": true, "msg": "", "total": 3, "result": [
+    {"status": 200, "success": true, "msg": "", "result": [...], "total": 1},
+    ...
+]}
+```
+
+- 在进程内直接调用操作，不经过http；最多同时执行`batch_concurrency`个；
+- `batch_once`的filter只对整个batch执行一次（适用于其中任何一个操作时执行），
+  结果（`core.filters.result`）在所有操作中共享；
+- 其他filter对每个操作的请求（method、path、query和batch的请求头）分别执行，
+  和单独请求时相同；`core.filters.memoize`在整个batch中共享，相同的查询只执行一次；
+- 每个操作使用batch请求的请求头，`rate_limit`、`max_in_flight`、`params`仍然有效；
+  不使用`cache_ttl`/`coalesce`，不能返回流，也不能自己输出响应；
+- 超过`batch_max_items`个操作时返回400。
+
+需要在settings中设置`batch_path`（例如`/batch`）才提供这个接口，默认不提供。
+其他settings：`batch_max_items`（默认50）、`batch_concurrency`（默认8）。
+
+"""
+import re
+import urllib
+
+from tornado import gen
+from tornado.escape import url_unescape, utf8
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.locks import Semaphore
+
+from core import metrics
+from core.admission import Rejected
+from core.base import ServiceBusy
+from core.context import RequestContext
+from core.rest import RestHandler, _filter
+
+__author__ = 'cuigang@easted.com.cn'
+
+_batch_size = metrics.histogram(
+    'rest_batch_items', 'Operations per /batch request.', (),
+    buckets=(1, 2, 5, 10, 20, 50, 100))
+
+
+class _Connection(object):
+    """ 批量中的操作没有自己的连接 """
+
+    def set_close_callback(self, callback):
+        pass
+
+
+class BatchHandler(RestHandler):
+    def initialize(self, rules, max_items=50, concurrency=8):
+        """
+        :param rules: [(正则, RestHandler的子类, kwargs)]，和Application中的顺序相同
+        """
+        self.rules = rules
+        self.max_items = max_items
+        self.concurrency = concurrency
+
+    @gen.coroutine
+    def post(self):
+        self.context = RequestContext('batch')
+        yield self.context.run(self._batch)
+
+    @gen.coroutine
+    def _batch(self):
+        res = {
+            "success": True,
+            "msg": "",
+            "result": [],
+            "total": 0
+        }
+        self.set_header("Content-Type", 'application/json')
+        try:
+            items = self.codec.loads(self.request.body or '[]')
+            if not isinstance(items, list):
+                raise ValueError('The body must be an array')
+            if len(items) > self.max_items:
+                raise ValueError('At most %d operations in a batch' %
+                                 self.max_items)
+            _batch_size.labels().observe(len(items))
+            targets = [self._target(item) for item in items]
+            yield _filter.run(self.request, [t[:2] for t in targets],
+                              batch_once=True)
+        except Exception as detail:
+            self.set_status(400 if isinstance(detail, ValueError) else
+                            self._error_status(detail))
+            if isinstance(detail, (Rejected, ServiceBusy)):
+                self.set_header('Retry-After', detail.retry_after)
+            res['success'] = False
+            res['msg'] = '%s' % detail
+            self.write(self.codec.dumps(res))
+            return
+
+        semaphore = Semaphore(self.concurrency)
+        results = yield [self._run_item(semaphore, *t) for t in targets]
+        res['result'] = results
+        res['total'] = len(results)
+        self.write(self.codec.dumps(res))
+
+    @staticmethod
+    def _target(item):
+        if not isinstance(item, dict) or not item.get('path'):
+            raise ValueError('Each operation must be an object with a path')
+        args = item.get('args') or {}
+        if not isinstance(args, dict):
+            raise ValueError('args must be an object')
+        # path中也可以带有query，和args合并
+        path, sep, query = item['path'].partition('?')
+        return (item.get('method', 'GET').upper(), path, query, args,
+                item.get('body'))
+
+    @gen.coroutine
+    def _run_item(self, semaphore, method, path, query, args, body):
+        with (yield semaphore.acquire()):
+            status, res = yield self._dispatch(method, path, query, args,
+                                               body)
+        res['status'] = status
+        raise gen.Return(res)
+
+    def _dispatch(self, method, path, query, args, body):
+        """ :return: Future，结果是(状态码, 响应的dict) """
+        for pattern, cls, kwargs in self.rules:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            name = kwargs['_rest_operations'].get(method)
+            if name is not None:
+                url_values = [url_unescape(match.group(p), plus=False)
+                              for p in kwargs['_rest_params']]
+            else:
+                # 和RestHandler._exe相同，再按参数段的操作查找
+                found = cls.route_table().match(method, path)
+                if found is None:
+                    return gen.maybe_future((405, _error(
+                        'The service not have %s verb' % method)))
+                name, url_values = found
+                url_values = [url_unescape(v, plus=False) for v in url_values]
+            handler = cls(self.application,
+                          self._item_request(method, path, query, args,
+                                             body),
+                          **kwargs)
+            handler.context = context = RequestContext()
+            # batch_once的filter的结果，每个操作的filter结果单独保存
+            context.filter_results = dict(self.context.filter_results)
+            context.memo = self.context.memo
+            return context.run(handler._invoke, name, url_values)
+        return gen.maybe_future((404, _error('Not found: %s' % path)))
+
+    def _item_request(self, method, path, query, args, body):
+        if args:
+            pairs = []
+            for k, values in args.items():
+                if not isinstance(values, list):
+                    values = [values]
+                for v in values:
+                    if isinstance(v, bool):
+                        v = 'true' if v else 'false'
+                    pairs.append((utf8(k), utf8(unicode(v))))
+            query = '&'.join(q for q in (query, urllib.urlencode(pairs)) if q)
+        uri = utf8(path + '?' + query if query else path)
+        headers = HTTPHeaders(self.request.headers)
+        headers.pop('Content-Length', None)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = utf8(self.codec.dumps(body))
+        request = HTTPServerRequest(
+            method=method, uri=uri, version=self.request.version,
+            headers=headers, body=body or b'', host=self.request.host,
+            connection=_Connection())
+        request.remote_ip = self.request.remote_ip
+        request.protocol = self.request.protocol
+        return request
+
+
+def _error(msg):
+    return {
+        "success": False,
+        "msg": msg,
+        "result": [],
+        "total": 0
+    }
+
+
+def batch_handlers(rest_services, settings):
+    """
+    由`RestService`调用。
+
+    :param rest_services: `RestHandler.get_handlers`生成的规则
+    :return: `/batch`的规则，settings中没有`batch_path`时返回空列表
+    """
+    path = settings.get('batch_path')
+    if not path:
+        return []
+    rules = [(re.compile(pattern), cls, kwargs)
+             for pattern, cls, kwargs in rest_services]
+    return [(path, BatchHandler, {
+        'rules': rules,
+        'max_items': settings.get('batch_max_items', 50),
+        'concurrency': settings.get('batch_concurrency', 8)
+    })]
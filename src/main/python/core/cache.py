@@ -0,0 +1,185 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供进程内的缓存工具：
+
+- `LRUCache`：带TTL、按占用内存淘汰、可以按tag失效的LRU缓存，
+  通过`generation`避免把失效之前读到的旧值写入缓存；
+- `SingleFlight`：相同key的并发调用只执行一次，其他调用共享同一个Future。
+
+只在IOLoop线程中使用，不加锁。
+
+"""
+import sys
+import time
+from collections import OrderedDict
+
+__author__ = 'cuigang@easted.com.cn'
+
+
+def sizeof(value):
+    """
+    估算值占用的内存，只展开list、tuple和dict一层。
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for v in value:
+            size += sys.getsizeof(v)
+            if isinstance(v, dict):
+                for i in v.itervalues():
+                    size += sys.getsizeof(i)
+    elif isinstance(value, dict):
+        for v in value.itervalues():
+            size += sys.getsizeof(v)
+    return size
+
+
+class LRUCache(object):
+    """
+    :param max_size: 最多占用的内存（字节），超过后淘汰最久没有使用的项
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._tags = {}
+        # 每个tag失效的次数，`clear`时增加_epoch
+        self._generations = {}
+        self._epoch = 0
+
+    def get(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            self.misses += 1
+            return default
+        expires, value, size, tags = item
+        if expires < time.time():
+            self._forget(key, item)
+            self.misses += 1
+            return default
+        self._data[key] = item
+        self.hits += 1
+        return value
+
+    def generation(self, tags):
+        """
+        读取数据之前调用，结果传递给`set`：
+
+        ```python
+        since = cache.generation(tags)
+        value = yield load()
+        cache.set(key, value, ttl, tags=tags, since=since)
+        ```
+
+        :return: 这些tag当前的版本
+        """
+        return self._epoch, tuple(self._generations.get(t, 0) for t in tags)
+
+    def set(self, key, value, ttl, size=None, tags=(), since=None):
+        """
+        :param ttl: 有效期（秒）
+        :param size: 占用的内存（字节），默认用`sizeof`估算
+        :param tags: 用于`invalidate`的tag
+        :param since: 读取value之前的`generation(tags)`，
+                      之后任何一个tag失效过时不写入，value可能已经过期
+        """
+        if since is not None and since != self.generation(tags):
+            return
+        if size is None:
+            size = sizeof(value)
+        if size > self.max_size:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._forget(key, old)
+        while self._data and self.size + size > self.max_size:
+            k, item = self._data.popitem(last=False)
+            self._forget(k, item)
+            self.evictions += 1
+        self._data[key] = (time.time() + ttl, value, size, tuple(tags))
+        self.size += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+
+    def delete(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._forget(key, item)
+
+    def invalidate(self, tag):
+        """ 删除所有带有tag的项 """
+        self._generations[tag] = self._generations.get(tag, 0) + 1
+        for key in self._tags.pop(tag, ()):
+            self.delete(key)
+
+    def clear(self):
+        self._epoch += 1
+        self._data.clear()
+        self._tags.clear()
+        self.size = 0
+
+    def _forget(self, key, item):
+        self.size -= item[2]
+        for tag in item[3]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        return {
+            'entries': len(self._data),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class SingleFlight(object):
+    """
+    相同key的并发调用共享一个Future：
+
+    ```python
+    rs = yield flight.do(key, lambda: self.load(key))
+    ```
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+
+    def do(self, key, fn):
+        """
+        :param fn: 返回Future的函数，只在没有相同key的调用时执行
+        :return: Future
+        """
+        fut = self._flights.get(key)
+        if fut is not None:
+            self.shared += 1
+            return fut
+        self.calls += 1
+        fut = fn()
+        self._flights[key] = fut
+        fut.add_done_callback(lambda f: self._flights.pop(key, None))
+        return fut
+
+    def in_flight(self, key):
+        """ :return: 是否有相同key的调用正在执行 """
+        return key in self._flights
+
+    def stats(self):
+        return {
+            'in_flight': len(self._flights),
+            'calls': self.calls,
+            'shared': self.shared
+        }
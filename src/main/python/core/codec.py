@@ -0,0 +1,297 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供请求body和响应的json编解码。
+
+通过`RestService`的settings选择实现：
+
+```python
+settings = {
+    'json_codec': 'auto'
+}
+```
+
+- `json`：标准库，默认值；
+- `simplejson`：需要安装simplejson（带C扩展），大量`Decimal`、`datetime`时最快；
+- `ujson`：需要安装ujson，编码前把`datetime`、`Decimal`转换成ujson支持的类型；
+- `orjson`：需要安装orjson（3.9以上，只支持python 3）；
+- `auto`：按`orjson`、`simplejson`、`ujson`的顺序使用已经安装的实现，都没有时使用标准库。
+
+各实现的速度参见`bench.codec_bench`。
+
+`DictCursor`返回的`datetime`、`date`、`time`编码成ISO 8601字符串，`Decimal`按原来的
+文本编码成数字（不经过float，不损失精度），各实现的输出格式一致。
+
+"""
+import datetime
+import decimal
+import itertools
+import json
+import operator
+
+__author__ = 'cuigang@easted.com.cn'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+_DATETIME_TYPES = (datetime.datetime, datetime.date, datetime.time)
+
+
+class _Number(int):
+    """
+    按给定的文本输出的数字：python 2的`json`对int的子类使用`str()`，
+    C扩展和纯python的实现都是这样。
+    """
+
+    def __new__(cls, text):
+        number = int.__new__(cls, 0)
+        number.text = text
+        return number
+
+    def __str__(self):
+        return self.text
+
+    __repr__ = __str__
+
+
+def _to_json_type(o):
+    if isinstance(o, _DATETIME_TYPES):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        if not o.is_finite():
+            # 和float相同，输出NaN/Infinity
+            return float(o)
+        return _Number(str(o))
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+class _Encoder(json.JSONEncoder):
+    def default(self, o):
+        return _to_json_type(o)
+
+
+class JSONCodec(object):
+    """
+    json编解码的标准库实现，也是其他实现的基类。
+    """
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = _Encoder()
+
+    def loads(self, s):
+        return json.loads(s)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+
+class _RawNumber(object):
+    """ ujson原样输出`__json__`的返回值 """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __json__(self):
+        return self.text
+
+
+def _raw_decimal(d):
+    if not d.is_finite():
+        raise OverflowError('%s can not be encoded' % d)
+    return _RawNumber(str(d))
+
+
+def _ujson_value(o):
+    if isinstance(o, _DATETIME_TYPES):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        return _raw_decimal(o)
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+_PLAIN = frozenset([str, unicode, int, long, float, bool, type(None)])
+
+
+def _ujson_any(o):
+    t = type(o)
+    if t in _PLAIN:
+        return o
+    if isinstance(o, (dict, list, tuple)):
+        return _ujson_convert(o)
+    return _ujson_value(o)
+
+
+# 只有一种需要转换的类型的列（常见的情况）直接使用对应的函数
+_COLUMN_CONVERTERS = {
+    datetime.datetime: datetime.datetime.isoformat,
+    datetime.date: datetime.date.isoformat,
+    datetime.time: datetime.time.isoformat,
+    decimal.Decimal: _raw_decimal,
+}
+
+
+def _ujson_column(values):
+    """ :return: 转换后的列，不需要转换时返回None """
+    types = set(map(type, values))
+    special = types - _PLAIN
+    if not special:
+        return None
+    if len(special) == 1:
+        convert = _COLUMN_CONVERTERS.get(next(iter(special)))
+        if convert is not None:
+            if len(types) == 1:
+                return map(convert, values)
+            return [v if type(v) in _PLAIN else convert(v) for v in values]
+    return map(_ujson_any, values)
+
+
+def _ujson_rows(rows):
+    """
+    `DictCursor`的结果：每行的key相同，按列判断类型，只转换需要转换的列，
+    循环尽量在C中执行。行的key不同时返回None。
+    """
+    if set(map(type, rows)) != {dict}:
+        return None
+    values = itertools.chain.from_iterable(map(dict.itervalues, rows))
+    if _PLAIN.issuperset(map(type, values)):
+        return rows
+    keys = rows[0].keys()
+    if set(map(len, rows)) != {len(keys)}:
+        return None
+    columns = []
+    try:
+        for k in keys:
+            values = _ujson_column(map(operator.itemgetter(k), rows))
+            if values is not None:
+                columns.append((k, values))
+    except KeyError:
+        return None
+    rs = map(dict, rows)
+    for k, values in columns:
+        for row, v in itertools.izip(rs, values):
+            row[k] = v
+    return rs
+
+
+def _ujson_convert(obj):
+    """
+    ujson不支持`default`，编码前转换；只复制需要转换的dict和list。
+    """
+    t = type(obj)
+    if t is dict:
+        rs = None
+        for k, v in obj.iteritems():
+            if type(v) not in _PLAIN:
+                if rs is None:
+                    rs = dict(obj)
+                rs[k] = _ujson_any(v)
+        return obj if rs is None else rs
+    if t is list or t is tuple:
+        if obj and type(obj[0]) is dict:
+            rs = _ujson_rows(obj)
+            if rs is not None:
+                return rs
+        return map(_ujson_any, obj)
+    if t in _PLAIN:
+        return obj
+    if isinstance(obj, dict):
+        return _ujson_convert(dict(obj))
+    if isinstance(obj, (list, tuple)):
+        return _ujson_convert(list(obj))
+    return _ujson_value(obj)
+
+
+class UJSONCodec(JSONCodec):
+    """
+    ujson不支持`default`，`datetime`转换成字符串，`Decimal`转换成原样输出的文本。
+    """
+    name = 'ujson'
+
+    def loads(self, s):
+        return ujson.loads(s)
+
+    def dumps(self, obj):
+        return ujson.dumps(_ujson_convert(obj), escape_forward_slashes=False)
+
+
+def _simplejson_default(o):
+    if isinstance(o, _DATETIME_TYPES):
+        return o.isoformat()
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+class SimpleJSONCodec(JSONCodec):
+    """
+    simplejson的C扩展通过`use_decimal`直接输出`Decimal`，只有datetime需要转换。
+    解码仍然使用标准库：simplejson对ascii的字符串返回str，和其他实现不一致。
+    """
+    name = 'simplejson'
+
+    def __init__(self):
+        # namedtuple和标准库一样编码成数组
+        self._encoder = simplejson.JSONEncoder(
+            use_decimal=True, namedtuple_as_object=False,
+            default=_simplejson_default)
+
+
+def _orjson_default(o):
+    if isinstance(o, decimal.Decimal) and o.is_finite():
+        return orjson.Fragment(str(o))
+    return _to_json_type(o)
+
+
+class ORJSONCodec(JSONCodec):
+    """
+    orjson原生支持datetime，`Decimal`通过`orjson.Fragment`原样输出。
+    """
+    name = 'orjson'
+
+    def loads(self, s):
+        return orjson.loads(s)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=_orjson_default)
+
+
+_codecs = {
+    'json': (JSONCodec, True),
+    'ujson': (UJSONCodec, ujson is not None),
+    'simplejson': (SimpleJSONCodec, simplejson is not None),
+    'orjson': (ORJSONCodec, orjson is not None and hasattr(orjson, 'Fragment')),
+}
+
+_AUTO_ORDER = ('orjson', 'simplejson', 'ujson', 'json')
+
+
+def get_codec(name='json'):
+    """
+    :param name: `json`、`ujson`、`simplejson`、`orjson`或`auto`，
+                 也可以直接传递`JSONCodec`的实例
+    :return: `JSONCodec`的实例
+    """
+    if isinstance(name, JSONCodec):
+        return name
+    if name == 'auto':
+        name = next(n for n in _AUTO_ORDER if _codecs[n][1])
+    if name not in _codecs:
+        raise ValueError('Unknown json codec: %s' % name)
+    cls, available = _codecs[name]
+    if not available:
+        raise ImportError('json codec %s is not installed' % name)
+    return cls()
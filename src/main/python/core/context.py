@@ -0,0 +1,89 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供请求的上下文。
+
+`RestHandler`在处理每个请求时创建一个`RequestContext`，处理请求的协程以及它调用的
+协程（例如`DBUtil`）中都可以通过`current()`取得，不需要逐层传递。
+
+基于tornado的`StackContext`：在上下文中注册的回调，执行时会恢复这个上下文。
+
+其他线程（例如`core.profiler`的采样线程）可以通过`context_of(thread_id)`
+查看某个线程当前在处理哪个请求。
+
+"""
+import functools
+import thread
+
+from tornado.stack_context import StackContext
+
+__author__ = 'cuigang@easted.com.cn'
+
+# thread id -> RequestContext
+_active = {}
+
+
+class RequestContext(object):
+    """
+    :param operation: 处理请求的方法，`类名.方法名`
+    """
+
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.db_time = 0.0
+        self.db_queries = 0
+        # 由core.profiler设置，上下文恢复时启用
+        self.profile = None
+        self.profile_target = None
+        # 由core.filters使用
+        self.filter_results = {}
+        self.memo = {}
+
+    def run(self, fn, *args, **kwargs):
+        """
+        在上下文中调用fn，fn是协程时返回的Future完成之前都在这个上下文中。
+        """
+        with StackContext(functools.partial(_Activate, self)):
+            return fn(*args, **kwargs)
+
+    def add_db_time(self, seconds):
+        self.db_time += seconds
+        self.db_queries += 1
+
+
+class _Activate(object):
+    def __init__(self, context):
+        self.context = context
+        self.previous = None
+        self.ident = None
+
+    def __enter__(self):
+        self.ident = thread.get_ident()
+        self.previous = _active.get(self.ident)
+        _active[self.ident] = self.context
+        if self.context.profile is not None:
+            self.context.profile.enable()
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.context.profile is not None:
+            self.context.profile.disable()
+        if self.previous is None:
+            _active.pop(self.ident, None)
+        else:
+            _active[self.ident] = self.previous
+
+
+def current():
+    """
+    :return: 当前的`RequestContext`，不在请求中时返回None
+    """
+    return _active.get(thread.get_ident())
+
+
+def context_of(thread_id):
+    """
+    :return: 线程正在处理的请求的`RequestContext`
+    """
+    return _active.get(thread_id)
@@ -0,0 +1,145 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块把CPU密集或者会阻塞的操作放到线程池/进程池中执行，IOLoop不会被阻塞。
+
+```python
+class Service(RestHandler):
+    @get(_path='/report/{id}', executor='process', max_concurrency=2)
+    def report(self, id):
+        return build_report(id)
+```
+
+- 被装饰的方法是普通的函数，不需要`@gen.coroutine`，返回值和其他操作一样处理；
+- `thread`：在线程池中执行，可以使用self中的属性，但不能调用`RequestHandler`的方法；
+- `process`：在进程池中执行，self是None，参数和返回值必须可以pickle；
+  类必须定义在模块的顶层；
+- `max_concurrency`：这个操作最多同时占用的线程/进程数，其他请求在IOLoop中等待。
+
+线程池和进程池在第一次使用时创建，多进程运行时每个worker有自己的池。
+大小通过`configure`设置，默认线程数是cpu个数的5倍，进程数是cpu个数。
+
+"""
+import importlib
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tornado import gen
+from tornado.locks import Semaphore
+
+from core import metrics
+from core.prefork import cpu_count
+
+__author__ = 'cuigang@easted.com.cn'
+
+_sizes = {
+    'thread': None,
+    'process': None
+}
+_executors = {}
+
+_pending = metrics.gauge(
+    'executor_pending', 'Calls submitted to the pool and not finished yet.',
+    ('executor',))
+_waiting = metrics.gauge(
+    'executor_waiting',
+    'Calls waiting for max_concurrency before being submitted.', ('route',))
+_queue_seconds = metrics.histogram(
+    'executor_queue_seconds', 'Time from submit until a worker started.',
+    ('route',))
+_run_seconds = metrics.histogram(
+    'executor_run_seconds', 'Time the call ran in the pool.', ('route',))
+
+
+def configure(threads=None, processes=None):
+    """
+    设置线程池和进程池的大小，只对之后创建的池有效。
+    """
+    if threads is not None:
+        _sizes['thread'] = threads
+    if processes is not None:
+        _sizes['process'] = processes
+
+
+def get_executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        if kind == 'thread':
+            executor = ThreadPoolExecutor(_sizes['thread'] or cpu_count() * 5)
+        elif kind == 'process':
+            executor = ProcessPoolExecutor(_sizes['process'] or cpu_count())
+        else:
+            raise ValueError('Unknown executor: %s' % kind)
+        _executors[kind] = executor
+    return executor
+
+
+def shutdown(wait=True):
+    for executor in _executors.values():
+        executor.shutdown(wait)
+    _executors.clear()
+
+
+def _run_in_thread(func, args, kwargs):
+    started = time.time()
+    return started, func(*args, **kwargs)
+
+
+def _run_in_process(module, cls_name, name, args, kwargs):
+    """ 在子进程中按名字找到操作，self传None """
+    cls = getattr(importlib.import_module(module), cls_name)
+    func = getattr(cls, name)._func
+    started = time.time()
+    return started, func(None, *args, **kwargs)
+
+
+class Offload(object):
+    """
+    由`core.rest.config`创建，调用时把操作提交到线程池/进程池，返回Future。
+    """
+
+    def __init__(self, func, kind, route, max_concurrency=None):
+        if kind not in _sizes:
+            raise ValueError('Unknown executor: %s' % kind)
+        self.func = func
+        self.kind = kind
+        self.semaphore = None
+        if max_concurrency:
+            self.semaphore = Semaphore(max_concurrency)
+        self.pending = _pending.labels(kind)
+        self.waiting = _waiting.labels(route)
+        self.queue_seconds = _queue_seconds.labels(route)
+        self.run_seconds = _run_seconds.labels(route)
+
+    def _submit(self, handler, args, kwargs):
+        executor = get_executor(self.kind)
+        if self.kind == 'thread':
+            return executor.submit(_run_in_thread, self.func,
+                                   (handler,) + args, kwargs)
+        cls = type(handler)
+        return executor.submit(_run_in_process, cls.__module__, cls.__name__,
+                               self.func.__name__, args, kwargs)
+
+    @gen.coroutine
+    def __call__(self, handler, *args, **kwargs):
+        if self.semaphore is not None:
+            self.waiting.inc()
+            try:
+                yield self.semaphore.acquire()
+            finally:
+                self.waiting.dec()
+        try:
+            submitted = time.time()
+            self.pending.inc()
+            try:
+                started, rs = yield self._submit(handler, args, kwargs)
+            finally:
+                self.pending.dec()
+            self.queue_seconds.observe(max(0.0, started - submitted))
+            self.run_seconds.observe(time.time() - started)
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+        raise gen.Return(rs)
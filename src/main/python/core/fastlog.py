@@ -0,0 +1,226 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供热点路径（例如每条SQL）使用的低开销日志：
+
+- `getLogger`：返回`FastLogger`，先检查级别，级别不够时不创建记录；
+  调用位置直接从调用者的frame取得，不调用`findCaller`遍历堆栈；
+- `CompiledFormatter`：`asctime`每秒只调用一次`strftime`，`usesTime`在创建时判断一次；
+- `RateLimitFilter`：相同语句的日志按采样率和每个周期的条数限流，
+  被抑制的条数附加在下一条输出的日志后面。
+
+通过`core.logger_base`配置：
+
+```python
+class SystemFormat(CompiledFormatter):
+    pass
+
+config.system.rate_limit(burst=20, interval=1.0, sample=0.1)
+```
+
+"""
+import logging
+import sys
+import time
+from logging import DEBUG, INFO, WARNING, ERROR
+
+from core import metrics
+
+__author__ = 'cuigang@easted.com.cn'
+
+# every RateLimitFilter created, for reporting suppressed lines
+rate_limit_filters = []
+
+
+class FastLogger(object):
+    """
+    和`logging.Logger`的常用方法相同，只支持位置参数。
+    """
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def isEnabledFor(self, level):
+        logger = self.logger
+        return (logger.manager.disable < level and
+                level >= logger.getEffectiveLevel())
+
+    def _log(self, level, msg, args, exc_info=None):
+        logger = self.logger
+        if exc_info and not isinstance(exc_info, tuple):
+            exc_info = sys.exc_info()
+        # 0: _log, 1: debug/info/..., 2: 调用者
+        f = sys._getframe(2)
+        record = logger.makeRecord(logger.name, level, f.f_code.co_filename,
+                                   f.f_lineno, msg, args, exc_info)
+        logger.handle(record)
+
+    # 每个方法自己检查级别，级别不够时只有一次方法调用的开销
+
+    def debug(self, msg, *args):
+        logger = self.logger
+        if (logger.manager.disable < DEBUG and
+                DEBUG >= logger.getEffectiveLevel()):
+            self._log(DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        logger = self.logger
+        if (logger.manager.disable < INFO and
+                INFO >= logger.getEffectiveLevel()):
+            self._log(INFO, msg, args)
+
+    def warning(self, msg, *args):
+        logger = self.logger
+        if (logger.manager.disable < WARNING and
+                WARNING >= logger.getEffectiveLevel()):
+            self._log(WARNING, msg, args)
+
+    warn = warning
+
+    def error(self, msg, *args):
+        logger = self.logger
+        if (logger.manager.disable < ERROR and
+                ERROR >= logger.getEffectiveLevel()):
+            self._log(ERROR, msg, args)
+
+    def exception(self, msg, *args):
+        logger = self.logger
+        if (logger.manager.disable < ERROR and
+                ERROR >= logger.getEffectiveLevel()):
+            self._log(ERROR, msg, args, exc_info=True)
+
+
+def getLogger(name):
+    return FastLogger(name)
+
+
+class CompiledFormatter(logging.Formatter):
+    """
+    和`logging.Formatter`的输出相同。
+
+    只缓存每秒的`strftime`结果；格式本身仍然是`self._fmt % record.__dict__`，
+    在python 2中按名字格式化比换成按位置格式化再用`attrgetter`取值更快。
+    """
+
+    def __init__(self, format=None, datefmt=None):
+        logging.Formatter.__init__(self, format, datefmt)
+        self._uses_time = self._fmt.find('%(asctime)') >= 0
+        self._second = None
+        self._time = None
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return logging.Formatter.formatTime(self, record, datefmt)
+        second = int(record.created)
+        if second != self._second:
+            self._time = time.strftime('%Y-%m-%d %H:%M:%S',
+                                       self.converter(second))
+            self._second = second
+        return '%s,%03d' % (self._time, record.msecs)
+
+    def usesTime(self):
+        return self._uses_time
+
+    def format(self, record):
+        record.message = record.getMessage()
+        if self._uses_time:
+            record.asctime = self.formatTime(record, self.datefmt)
+        s = self._fmt % record.__dict__
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            if s[-1:] != '\n':
+                s += '\n'
+            try:
+                s += record.exc_text
+            except UnicodeError:
+                s += record.exc_text.decode(sys.getfilesystemencoding(),
+                                            'replace')
+        return s
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    相同语句的日志（`msg`和第一个参数相同，例如`LOG.info('%s %s', sql, args)`
+    中的sql）只输出一部分。
+
+    :param burst: 每个周期最多输出的条数，None表示不限制
+    :param interval: 周期（秒）
+    :param sample: 采样率，0.1表示每10条输出1条
+    :param max_keys: 最多记录的语句数，超过后清空重新计数
+    :param label: `/metrics`中区分filter的名字，`core.logger_base`中是handler或logger的名字
+    """
+
+    def __init__(self, burst=None, interval=1.0, sample=1.0, max_keys=10000,
+                 label=None):
+        logging.Filter.__init__(self)
+        self.label = label or str(len(rate_limit_filters))
+        self.burst = burst
+        self.interval = interval
+        self.every = max(1, int(round(1.0 / sample)))
+        self.max_keys = max_keys
+        self.passed = 0
+        self.suppressed = 0
+        # key -> [周期开始的时间, 周期内的条数, 上次输出后抑制的条数]
+        self._state = {}
+        rate_limit_filters.append(self)
+
+    def filter(self, record):
+        # 前面的filter可能已经在msg后面附加了抑制的条数
+        msg = getattr(record, 'raw_msg', record.msg)
+        args = record.args
+        if isinstance(args, tuple) and args:
+            key = (msg, args[0])
+        else:
+            key = msg
+        try:
+            state = self._state.get(key)
+        except TypeError:
+            return True
+        if state is None:
+            if len(self._state) >= self.max_keys:
+                self._state.clear()
+            state = self._state[key] = [record.created, 0, 0]
+        elif record.created - state[0] >= self.interval:
+            state[0] = record.created
+            state[1] = 0
+        state[1] += 1
+        n = state[1]
+        if (self.burst is not None and n > self.burst) or (n - 1) % self.every:
+            state[2] += 1
+            self.suppressed += 1
+            return False
+        if state[2]:
+            record.raw_msg = msg
+            record.msg = '%s [%d similar lines suppressed]' % (record.msg,
+                                                               state[2])
+            state[2] = 0
+        self.passed += 1
+        return True
+
+    def stats(self):
+        return {
+            'keys': len(self._state),
+            'passed': self.passed,
+            'suppressed': self.suppressed
+        }
+
+
+def _collect():
+    """ 供`/metrics`读取各`RateLimitFilter`输出和抑制的条数 """
+    samples = []
+    for f in rate_limit_filters:
+        stats = f.stats()
+        for result in ('passed', 'suppressed'):
+            samples.append(('', [('filter', f.label), ('result', result)],
+                            stats[result]))
+    return [
+        ('log_rate_limited_total', 'counter',
+         'Log lines passed and suppressed by the rate limit filters.',
+         samples),
+    ]
+
+
+metrics.add_collector(_collect)
@@ -0,0 +1,219 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块实现`core.rest`的request filter chain。
+
+```python
+@gen.coroutine
+def auth(request):
+    user = yield check_token(request.headers.get('X-Auth-Token'))
+    raise gen.Return(user)
+
+
+@gen.coroutine
+def quota(request):
+    user = filters.result('auth')
+    tenant = yield filters.memoize('tenant', lambda: load_tenant(user))
+    ...
+
+rest.add_filter(auth)
+rest.add_filter(tenant_log, paths=('/vm', '/volume'))
+rest.add_filter(quota, depends=('auth',), methods=('POST', 'PUT'))
+```
+
+- `depends`：依赖的filter的名字（默认是函数名），在它们完成之后执行；
+  没有依赖关系的filter通过`gen.multi`同时执行；
+- `paths`：正则表达式，从请求的path开头匹配，都不匹配时跳过这个filter；
+- `methods`：只在这些http方法时执行；
+- 任何一个filter抛出异常时，请求立即失败，不等待同一层中其他的filter，
+  之后的filter不再执行；其他filter之后的异常只写日志；
+- filter的返回值可以通过`result(名字)`取得，依赖它的filter和被装饰的方法中都可以使用；
+- `memoize(key, factory)`：同一个请求中只执行一次factory，filter之间共享结果；
+- `batch_once`：`/batch`请求中只对整个batch执行一次（例如只检查请求头的认证），
+  其他filter对batch中的每个操作分别执行，参见`core.batch`。
+
+依赖的filter因为`paths`/`methods`被跳过时，视为已经完成，`result`返回None。
+每个filter的耗时通过`/metrics`的`rest_filter_seconds`输出。
+
+"""
+import logging
+import re
+import time
+
+from tornado import gen
+from tornado.concurrent import Future, is_future
+
+from core import context, metrics
+
+__author__ = 'cuigang@easted.com.cn'
+
+LOG = logging.getLogger('system')
+
+_filter_seconds = metrics.histogram(
+    'rest_filter_seconds', 'Time spent in each request filter.', ('filter',))
+
+
+class Filter(object):
+    def __init__(self, func, depends=(), paths=None, methods=None, name=None,
+                 batch_once=False):
+        self.func = func
+        self.batch_once = batch_once
+        self.name = name or func.__name__
+        self.depends = tuple(depends)
+        self.paths = None
+        if paths is not None:
+            self.paths = [re.compile(p) for p in paths]
+        self.methods = None
+        if methods is not None:
+            self.methods = frozenset(m.upper() for m in methods)
+        self.seconds = _filter_seconds.labels(self.name)
+
+    def applies(self, method, path):
+        if self.methods is not None and method not in self.methods:
+            return False
+        if self.paths is not None:
+            return any(p.match(path) for p in self.paths)
+        return True
+
+    @gen.coroutine
+    def __call__(self, request, ctx):
+        start = time.time()
+        try:
+            rs = self.func(request)
+            if is_future(rs):
+                rs = yield rs
+        finally:
+            self.seconds.observe(time.time() - start)
+        if ctx is not None:
+            ctx.filter_results[self.name] = rs
+        raise gen.Return(rs)
+
+
+class FilterChain(object):
+    """
+    filter按依赖关系分层，同一层的filter同时执行。
+    分层在添加filter之后的第一个请求时计算一次。
+    """
+
+    def __init__(self):
+        self.filters = []
+        self._levels = None
+
+    def add(self, func, depends=(), paths=None, methods=None, name=None,
+            batch_once=False):
+        f = Filter(func, depends, paths, methods, name, batch_once)
+        if any(f.name == other.name for other in self.filters):
+            raise ValueError('Duplicate filter: %s' % f.name)
+        self.filters.append(f)
+        self._levels = None
+        return f
+
+    def levels(self):
+        if self._levels is None:
+            self._levels = self._compile()
+        return self._levels
+
+    def _compile(self):
+        filters = dict((f.name, f) for f in self.filters)
+        for f in self.filters:
+            for d in f.depends:
+                if d not in filters:
+                    raise ValueError(
+                        'Filter %s depends on unknown filter %s' % (f.name, d))
+                if f.batch_once and not filters[d].batch_once:
+                    raise ValueError(
+                        'Filter %s is batch_once but depends on %s' % (
+                            f.name, d))
+        levels = []
+        done = set()
+        remaining = list(self.filters)
+        while remaining:
+            level = [f for f in remaining
+                     if all(d in done for d in f.depends)]
+            if not level:
+                raise ValueError('Circular filter dependencies: %s' % ', '.join(
+                    f.name for f in remaining))
+            levels.append(level)
+            done.update(f.name for f in level)
+            remaining = [f for f in remaining if f.name not in done]
+        return levels
+
+    @gen.coroutine
+    def run(self, request, targets=None, batch_once=None):
+        """
+        :param targets: [(方法, path)]，filter适用于其中任何一个时执行，
+                        默认是request本身；用于`core.batch`
+        :param batch_once: True/False时只执行`batch_once`相同的filter，
+                           None时执行所有的filter
+        """
+        if not self.filters:
+            return
+        ctx = context.current()
+        method = request.method
+        path = request.path
+        for level in self.levels():
+            if batch_once is not None:
+                level = [f for f in level if f.batch_once == batch_once]
+            if targets is None:
+                futures = [f(request, ctx) for f in level
+                           if f.applies(method, path)]
+            else:
+                futures = [f(request, ctx) for f in level
+                           if any(f.applies(m, p) for m, p in targets)]
+            if len(futures) == 1:
+                yield futures[0]
+            elif futures:
+                yield _all_or_first_error(futures)
+
+
+def _all_or_first_error(futures):
+    """
+    和`gen.multi`不同，有一个失败时立即失败，不等待其他的Future。
+
+    :return: Future，都成功时结果是None
+    """
+    result = Future()
+    pending = [len(futures)]
+
+    def done(future):
+        pending[0] -= 1
+        if future.exception() is not None:
+            if not result.done():
+                result.set_exc_info(future.exc_info())
+            else:
+                LOG.error('Filter failed after the request was rejected',
+                          exc_info=future.exc_info())
+        elif pending[0] == 0 and not result.done():
+            result.set_result(None)
+
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+
+def result(name):
+    """
+    :return: 当前请求中名字为name的filter的返回值
+    """
+    ctx = context.current()
+    if ctx is None:
+        return None
+    return ctx.filter_results.get(name)
+
+
+def memoize(key, factory):
+    """
+    同一个请求中只执行一次factory，之后（以及同时）的调用返回相同的Future。
+
+    :param factory: 没有参数的函数，可以是协程
+    :return: Future
+    """
+    ctx = context.current()
+    if ctx is None:
+        return gen.maybe_future(factory())
+    future = ctx.memo.get(key)
+    if future is None:
+        future = ctx.memo[key] = gen.maybe_future(factory())
+    return future
@@ -0,0 +1,212 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块缓存GET操作编码后的响应。
+
+```python
+class Service(RestHandler):
+    @gen.coroutine
+    @get(_path='/vm/{id}?<detail>', cache_ttl=60,
+         cache_headers=('Accept-Language',))
+    def show(self, id, detail):
+        ...
+```
+
+- `cache_ttl`：缓存的时间（秒）；
+- `cache_args`：作为key的query参数，默认是方法的所有参数（path和query）；
+- `cache_headers`：作为key的请求头。
+
+缓存的是json编码后的bytes，开启了gzip（settings的`gzip`或`compress_response`）时
+同时缓存gzip压缩后的bytes，直接输出，tornado不再压缩。
+
+响应带有强`ETag`，请求的`If-None-Match`相同时返回304。
+filter仍然每次执行（可能用于认证），缓存命中时不执行被装饰的方法。
+相同key的并发请求只执行一次方法。
+
+缓存只按时间失效，也可以通过`invalidate(operation)`删除一个操作的所有缓存。
+被装饰的方法不能返回流。
+
+`@get`的`coalesce=True`只合并并发的相同请求，不缓存：key相同的请求同时到达时，
+只有第一个执行方法，其他请求等待并得到相同的响应；完成之后的请求重新执行。
+`cache_args`、`cache_headers`同样用于生成key。合并的比例通过
+`rest_coalesced_requests_total`和`rest_coalesce_ratio`输出。
+
+"""
+import gzip
+import hashlib
+from io import BytesIO
+
+from tornado import gen
+
+from core import metrics
+from core.cache import LRUCache, SingleFlight
+
+__author__ = 'cuigang@easted.com.cn'
+
+# 小于这个长度时不压缩，和tornado的GZipContentEncoding相同
+GZIP_MIN_LENGTH = 1024
+
+response_cache = LRUCache()
+_flight = SingleFlight()
+
+_lookups = metrics.counter(
+    'rest_response_cache_total',
+    'Cached GET responses by result: hit, miss or not_modified (304).',
+    ('operation', 'result'))
+_coalesced = metrics.counter(
+    'rest_coalesced_requests_total',
+    'Coalesced GET requests by role: leader ran the operation, follower '
+    'shared its response.',
+    ('operation', 'role'))
+
+# operation -> [leader数, follower数]
+_coalesce_counts = {}
+
+
+def configure(max_size):
+    """
+    :param max_size: 缓存最多占用的内存（字节）
+    """
+    response_cache.max_size = max_size
+
+
+def invalidate(operation):
+    """
+    :param operation: `类名.方法名`
+    """
+    response_cache.invalidate(operation)
+
+
+def _collect():
+    stats = response_cache.stats()
+    ratios = [('', [('operation', operation)],
+               float(followers) / (leaders + followers))
+              for operation, (leaders, followers) in
+              sorted(_coalesce_counts.items())]
+    return [
+        ('rest_response_cache_bytes', 'gauge',
+         'Memory used by cached responses.', [('', [], stats['size'])]),
+        ('rest_response_cache_entries', 'gauge',
+         'Number of cached responses.', [('', [], stats['entries'])]),
+        ('rest_coalesce_ratio', 'gauge',
+         'Share of coalesced GET requests that did not run the operation.',
+         ratios),
+    ]
+
+
+metrics.add_collector(_collect)
+
+
+class CachedResponse(object):
+    def __init__(self, body, compress=False):
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.gzipped = None
+        self.gzip_etag = None
+        if compress and len(body) >= GZIP_MIN_LENGTH:
+            buf = BytesIO()
+            f = gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=6,
+                              mtime=0)
+            f.write(body)
+            f.close()
+            self.gzipped = buf.getvalue()
+            # 不同的编码是不同的表示，需要不同的强ETag
+            self.gzip_etag = '"%s-gzip"' % self.etag[1:-1]
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gzipped or '') + 200
+
+
+class ResponseCache(object):
+    """
+    一个操作的缓存设置，由`core.rest.config`创建。
+    """
+    # 304是否计入rest_response_cache_total
+    counted = True
+
+    def __init__(self, ttl, args=None, headers=()):
+        self.ttl = ttl
+        self.args = tuple(args) if args is not None else None
+        self.headers = tuple(headers)
+
+    def key(self, operation, url_values, p_values, request):
+        if self.args is None:
+            values = tuple(p_values)
+        else:
+            arguments = request.arguments
+            values = tuple(url_values) + tuple(
+                arguments[a][0] if a in arguments else None
+                for a in self.args)
+        if self.headers:
+            values += tuple(request.headers.get(h) for h in self.headers)
+        return operation, values
+
+    def fetch(self, operation, key, render):
+        """
+        :param render: 返回Future的函数，结果是`CachedResponse`
+        :return: Future
+        """
+        entry = response_cache.get(key)
+        if entry is not None:
+            _lookups.labels(operation, 'hit').inc()
+            return gen.maybe_future(entry)
+        _lookups.labels(operation, 'miss').inc()
+
+        @gen.coroutine
+        def fill():
+            entry = yield render()
+            response_cache.set(key, entry, self.ttl, size=entry.size,
+                               tags=(operation,))
+            raise gen.Return(entry)
+
+        return _flight.do(key, fill)
+
+
+class Coalescer(ResponseCache):
+    """
+    `coalesce=True`时由`core.rest.config`创建，只合并同时执行的请求。
+    """
+    counted = False
+
+    def __init__(self, args=None, headers=()):
+        super(Coalescer, self).__init__(0, args, headers)
+        self._flight = SingleFlight()
+
+    def fetch(self, operation, key, render):
+        counts = _coalesce_counts.get(operation)
+        if counts is None:
+            counts = _coalesce_counts[operation] = [0, 0]
+        if self._flight.in_flight(key):
+            counts[1] += 1
+            _coalesced.labels(operation, 'follower').inc()
+        else:
+            counts[0] += 1
+            _coalesced.labels(operation, 'leader').inc()
+        return self._flight.do(key, render)
+
+
+def write_cached(handler, operation, entry, counted=True):
+    """
+    输出缓存的响应，`If-None-Match`相同时返回304。
+
+    :param counted: 是否计入`rest_response_cache_total`
+    """
+    handler.set_header('Content-Type', 'application/json')
+    gzipped = entry.gzipped is not None and 'gzip' in handler.request.headers.get(
+        'Accept-Encoding', '')
+    # Vary由tornado的GZipContentEncoding设置
+    handler.set_header('Etag', entry.gzip_etag if gzipped else entry.etag)
+    if handler.check_etag_header():
+        if counted:
+            _lookups.labels(operation, 'not_modified').inc()
+        handler.set_status(304)
+        return
+    if gzipped:
+        # 已经有Content-Encoding时tornado不再压缩
+        handler.set_header('Content-Encoding', 'gzip')
+        handler.write(entry.gzipped)
+    else:
+        handler.write(entry.body)
@@ -3,7 +3,7 @@ import logger_base as log
 __author__ = 'cuigang@easted.com.cn'
 
 
-class SystemFormat(log.LoggerFormatter):
+class SystemFormat(log.CompiledFormatter):
     pass
 
 
@@ -24,6 +24,23 @@ class TimedRotatingFileHandler(log.LoggerHandler):
         self.backupCount = 3650
 
 
+class BufferedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    __name__ = 'buffered_handler'
+
+    def __init__(self):
+        super(BufferedTimedRotatingFileHandler, self).__init__()
+        self.bufferSize = 64 * 1024
+        self.flushInterval = 1.0
+
+
+class SharedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    __name__ = 'shared_handler'
+
+    def __init__(self):
+        super(SharedTimedRotatingFileHandler, self).__init__()
+        self.multiProcess = True
+
+
 class ErrorHandler(TimedRotatingFileHandler):
     __name__ = 'error_handler'
 
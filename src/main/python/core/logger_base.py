@@ -1,3 +1,4 @@
+# coding=utf-8
 import types
 import base
 
@@ -11,7 +12,21 @@ system_log_format = (
 )
 
 
-class LoggerHandler(base.ToDict):
+class RateLimited(object):
+    """
+    用于mixin，给handler或logger加上core.fastlog.RateLimitFilter。
+    """
+
+    def rate_limit(self, burst=None, interval=1.0, sample=1.0):
+        self.limit = {
+            'burst': burst,
+            'interval': interval,
+            'sample': sample
+        }
+        return self
+
+
+class LoggerHandler(base.ToDict, RateLimited):
     def __init__(self):
         self.class_name = 'logging.StreamHandler'
         self.level = system_log_level
@@ -33,7 +48,18 @@ class LoggerFormatter(base.AllFiledToDict):
         self.format = system_log_format
 
 
-class Loggers(base.AllFiledToDict):
+class CompiledFormatter(LoggerFormatter):
+    """
+    使用core.fastlog.CompiledFormatter，输出和LoggerFormatter相同。
+    """
+
+    def to_dict(self):
+        rs = super(CompiledFormatter, self).to_dict()
+        rs['()'] = 'core.fastlog.CompiledFormatter'
+        return rs
+
+
+class Loggers(base.AllFiledToDict, RateLimited):
     def __init__(self):
         self.level = system_log_level
         self.handlers = []
@@ -43,6 +69,19 @@ class Loggers(base.AllFiledToDict):
 class LoggerConfig(object):
     def __init__(self):
         self.handlers = {}
+        self.queue = None
+
+    def use_queue(self, capacity=10000, overflow='drop_debug', batch_size=100):
+        """
+        所有的handler都通过core.logger_handler.QueueHandler输出，
+        写日志时只把记录放入队列，由后台线程写文件。
+        """
+        self.queue = {
+            'capacity': capacity,
+            'overflow': overflow,
+            'batch_size': batch_size
+        }
+        return self
 
     def add_handler(self, handler, logger, formatter):
         self.handlers[handler.__name__] = handler.to_dict()
@@ -57,12 +96,44 @@ class LoggerConfig(object):
             'version': 1,
             'handlers': self.handlers,
             'formatters': {},
+            'filters': {},
             'loggers': {}
         }
+        rs['handlers'] = dict(
+            (k, self._limited(k, dict(v), rs['filters']))
+            for k, v in self.handlers.items())
+        if self.queue is not None:
+            rs['handlers'] = dict(
+                (k, self._queued(v)) for k, v in rs['handlers'].items())
         for k, v in self.__dict__.items():
             if isinstance(v, Loggers):
-                rs['loggers'][k] = v.to_dict()
+                rs['loggers'][k] = self._limited(k, v.to_dict(), rs['filters'])
             if isinstance(v, LoggerFormatter):
                 rs['formatters'][k] = v.to_dict()
 
         return rs
+
+    def _queued(self, handler):
+        rs = {
+            'class': 'core.logger_handler.QueueHandler',
+            'target': handler
+        }
+        rs.update(self.queue)
+        for k in ('level', 'formatter'):
+            if k in handler:
+                rs[k] = handler[k]
+        if 'filters' in handler:
+            # 放入队列之前过滤
+            rs['filters'] = handler.pop('filters')
+        return rs
+
+    def _limited(self, name, config, filters):
+        """
+        把rate_limit的设置换成dictConfig的filter。
+        """
+        limit = config.pop('limit', None)
+        if limit is not None:
+            filters[name + '_rate_limit'] = dict(
+                limit, label=name, **{'()': 'core.fastlog.RateLimitFilter'})
+            config['filters'] = [name + '_rate_limit']
+        return config
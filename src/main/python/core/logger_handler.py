@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
-import errno, logging, socket, os, cPickle, struct, time, re
+import errno, logging, socket, os, cPickle, struct, time, re, threading, Queue
 from stat import  ST_MTIME
 from logging.handlers import BaseRotatingHandler
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from core import metrics
 __author__ = 'litao@easted.com.cn'
 
 _MIDNIGHT = 24 * 60 * 60  # number of seconds in a day
 
+_STOP = object()
+
+# every QueueHandler created, for reporting queue depth and dropped records
+queue_handlers = []
+
 
 class TimedRotatingFileHandler(BaseRotatingHandler):
     """
@@ -14,8 +24,33 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
 
     If backupCount is > 0, when rollover is done, no more than backupCount
     files are kept - the oldest ones are deleted.
+
+    If bufferSize is > 0, the handler runs in high-throughput mode: formatted
+    lines are kept in memory and written once bufferSize bytes are pending, or
+    by a background thread every flushInterval seconds. That thread also
+    deletes the expired backups, and the backups are tracked in an index
+    built once at startup instead of listing the log directory at every
+    rollover.
+
+    If multiProcess is true, several processes can log to the same file. The
+    file is opened with O_APPEND and every line (or buffer) goes to the disk
+    in one write, so lines from different processes never interleave. The
+    rollover is done under a lock file (filename + '.lock'): the first process
+    renames the file, the others find the dated file already there and just
+    reopen. Every process also checks once a second whether the file was
+    moved away (by another process or by logrotate) and reopens it.
     """
-    def __init__(self, filename, when='h', interval=1, backupCount=0, encoding=None, delay=False, utc=False):
+    def __init__(self, filename, when='h', interval=1, backupCount=0, encoding=None, delay=False, utc=False,
+                 bufferSize=0, flushInterval=1.0, multiProcess=False):
+        self.multiProcess = multiProcess
+        self._checkAt = 0
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self._buffer = []
+        self._buffered = 0
+        self._backups = None
+        self._expired = []
+        self._closed = False
         BaseRotatingHandler.__init__(self, filename, 'a', encoding, delay)
         self.when = when.upper()
         self.backupCount = backupCount
@@ -67,6 +102,13 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
         else:
             t = int(time.time())
         self.rolloverAt = self.computeRollover(t)
+        if self.bufferSize:
+            if not multiProcess:
+                # other processes add backups too, the index would be stale
+                self._backups = self._scanBackups()
+            worker = threading.Thread(target=self._maintain, name='log-flusher')
+            worker.daemon = True
+            worker.start()
 
     def computeRollover(self, currentTime):
         """
@@ -132,11 +174,9 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
         """
         Determine if rollover should occur.
 
-        record is not used, as we are just comparing times, but it is needed so
-        the method signatures are the same
+        The creation time of the record is used, so no clock is read here.
         """
-        t = int(time.time())
-        if t >= self.rolloverAt:
+        if record.created >= self.rolloverAt:
             return 1
         #print "No need to rollover: %d, %d" % (t, self.rolloverAt)
         return 0
@@ -147,6 +187,13 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
 
         More specific than the earlier method, which just used glob.glob().
         """
+        if self._backups is not None:
+            if len(self._backups) <= self.backupCount:
+                return []
+            n = len(self._backups) - self.backupCount
+            result = self._backups[:n]
+            del self._backups[:n]
+            return result
         dirName, baseName = os.path.split(self.baseFilename)
         fileNames = os.listdir(dirName)
         result = []
@@ -172,6 +219,8 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
         then we have to get a list of matching filenames, sort them and remove
         the one with the oldest suffix.
         """
+        if self._buffer:
+            self.flush()
         if self.stream:
             self.stream.close()
             self.stream = None
@@ -191,16 +240,11 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
                     addend = -3600
                 timeTuple = time.localtime(t + addend)
         dfn = self.baseFilename + "." + time.strftime(self.suffix, timeTuple)
-        if not os.path.exists(dfn):
-            os.rename(self.baseFilename, dfn)
-        if self.backupCount > 0:
-            # find the oldest log file and delete it
-            #s = glob.glob(self.baseFilename + ".20*")
-            #if len(s) > self.backupCount:
-            #    s.sort()
-            #    os.remove(s[0])
-            for s in self.getFilesToDelete():
-                os.remove(s)
+        lock = self._lock()
+        try:
+            self._rotate(dfn)
+        finally:
+            self._unlock(lock)
         #print "%s -> %s" % (self.baseFilename, dfn)
         self.stream = self._open()
         newRolloverAt = self.computeRollover(currentTime)
@@ -216,3 +260,314 @@ class TimedRotatingFileHandler(BaseRotatingHandler):
                     addend = 3600
                 newRolloverAt += addend
         self.rolloverAt = newRolloverAt
+
+    def _rotate(self, dfn):
+        if os.path.exists(dfn):
+            # another process has already rolled the file over
+            return
+        try:
+            os.rename(self.baseFilename, dfn)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        if self._backups is not None:
+            self._backups.append(dfn)
+        if self.backupCount > 0:
+            # find the oldest log file and delete it
+            #s = glob.glob(self.baseFilename + ".20*")
+            #if len(s) > self.backupCount:
+            #    s.sort()
+            #    os.remove(s[0])
+            if self.bufferSize:
+                # deleted by the flusher thread
+                self._expired.extend(self.getFilesToDelete())
+            else:
+                for s in self.getFilesToDelete():
+                    try:
+                        os.remove(s)
+                    except OSError:
+                        pass
+
+    def _lock(self):
+        if not self.multiProcess or fcntl is None:
+            return None
+        fd = os.open(self.baseFilename + '.lock', os.O_WRONLY | os.O_CREAT, 0644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _unlock(self, fd):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _reopenIfMoved(self):
+        """
+        Reopen the file if it is no longer the one at baseFilename.
+        """
+        if self.stream is None:
+            return
+        try:
+            moved = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except OSError:
+            moved = True
+        if moved:
+            if self._buffer:
+                self.flush()
+            self.stream.close()
+            self.stream = self._open()
+
+    def _scanBackups(self):
+        dirName, baseName = os.path.split(self.baseFilename)
+        prefix = baseName + "."
+        plen = len(prefix)
+        result = [os.path.join(dirName, f) for f in os.listdir(dirName)
+                  if f[:plen] == prefix and self.extMatch.match(f[plen:])]
+        result.sort()
+        return result
+
+    def _open(self):
+        if self.multiProcess:
+            return _AppendStream(self.baseFilename, self.encoding)
+        if self.bufferSize:
+            # lines are encoded in emit, the file only sees bytes
+            return open(self.baseFilename, self.mode)
+        return BaseRotatingHandler._open(self)
+
+    def emit(self, record):
+        if self.multiProcess and record.created >= self._checkAt:
+            self._checkAt = record.created + 1
+            try:
+                self._reopenIfMoved()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.handleError(record)
+        if not self.bufferSize:
+            BaseRotatingHandler.emit(self, record)
+            return
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            msg = self.format(record)
+            if isinstance(msg, unicode):
+                msg = msg.encode(self.encoding or 'utf-8')
+            self._buffer.append(msg + '\n')
+            self._buffered += len(msg) + 1
+            if self._buffered >= self.bufferSize:
+                self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._buffer:
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream.write(''.join(self._buffer))
+                self._buffer = []
+                self._buffered = 0
+        finally:
+            self.release()
+        BaseRotatingHandler.flush(self)
+
+    def _maintain(self):
+        while not self._closed:
+            time.sleep(self.flushInterval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+            while self._expired:
+                try:
+                    os.remove(self._expired.pop(0))
+                except OSError:
+                    pass
+
+    def close(self):
+        self._closed = True
+        self.flush()
+        BaseRotatingHandler.close(self)
+
+
+class _AppendStream(object):
+    """
+    Unbuffered file opened with O_APPEND, each write goes to the end of the
+    file in one system call even when other processes write to it too.
+    """
+    def __init__(self, filename, encoding=None):
+        self.name = filename
+        self.encoding = encoding
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode(self.encoding or 'utf-8')
+        while data:
+            n = os.write(self.fd, data)
+            data = data[n:]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler that puts records into a bounded in-memory queue; a background
+    thread takes them out in batches and passes them to the target handler,
+    so the caller (usually the IOLoop thread) never waits for the disk.
+
+    target is the dict config of the real handler, e.g.
+    {'class': 'core.logger_handler.TimedRotatingFileHandler', 'filename': ...}.
+
+    overflow decides what happens when the writer cannot keep up:
+
+    drop_debug - DEBUG records are dropped once the queue is 80% full, INFO
+                 and WARNING once it is full; ERROR and above wait up to one
+                 second for room before being dropped.
+    block      - the caller waits until there is room.
+    """
+    def __init__(self, target, capacity=10000, overflow='drop_debug', batch_size=100):
+        logging.Handler.__init__(self)
+        if overflow not in ('drop_debug', 'block'):
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+        if isinstance(target, dict):
+            target = _build_handler(target)
+        self.target = target
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.high_water = int(capacity * 0.8)
+        self.queue = Queue.Queue(capacity)
+        self.dropped = {}
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        queue_handlers.append(self)
+
+    def setFormatter(self, fmt):
+        logging.Handler.setFormatter(self, fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Merge the args into the message and render the traceback now, the
+        objects they refer to may change before the writer thread runs.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.prepare(record)
+            if self.overflow == 'block':
+                self.queue.put(record)
+            elif record.levelno >= logging.ERROR:
+                self.queue.put(record, timeout=1)
+            elif record.levelno <= logging.DEBUG and self.queue.qsize() >= self.high_water:
+                self._drop(record)
+            else:
+                self.queue.put_nowait(record)
+        except Queue.Full:
+            self._drop(record)
+        except Exception:
+            self.handleError(record)
+
+    def _drop(self, record):
+        self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            for record in batch:
+                if record is _STOP:
+                    self.target.flush()
+                    return
+                try:
+                    self.target.handle(record)
+                except Exception:
+                    self.target.handleError(record)
+            self.target.flush()
+
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'capacity': self.capacity,
+            'dropped': dict(self.dropped)
+        }
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(5)
+        self.target.close()
+        if self in queue_handlers:
+            queue_handlers.remove(self)
+        logging.Handler.close(self)
+
+
+def _label(handler):
+    """The handler name from dictConfig, or the file it writes to."""
+    return (getattr(handler, 'name', None) or
+            getattr(handler.target, 'baseFilename', None) or
+            type(handler.target).__name__)
+
+
+def _collect():
+    """Queue depth and dropped records of every QueueHandler, for /metrics."""
+    depth = []
+    capacity = []
+    dropped = []
+    for handler in list(queue_handlers):
+        stats = handler.stats()
+        labels = [('handler', _label(handler))]
+        depth.append(('', labels, stats['depth']))
+        capacity.append(('', labels, stats['capacity']))
+        for level, n in sorted(stats['dropped'].items()):
+            dropped.append(('', labels + [('level', level)], n))
+    return [
+        ('log_queue_depth', 'gauge',
+         'Log records waiting for the writer thread.', depth),
+        ('log_queue_capacity', 'gauge',
+         'Maximum number of log records in the queue.', capacity),
+        ('log_dropped_total', 'counter',
+         'Log records dropped because the queue was full, by level.',
+         dropped),
+    ]
+
+
+metrics.add_collector(_collect)
+
+
+def _build_handler(config):
+    """
+    Create a handler from a dict like the ones in dictConfig 'handlers'.
+    """
+    config = dict(config)
+    module, name = config.pop('class').rsplit('.', 1)
+    level = config.pop('level', None)
+    config.pop('formatter', None)
+    handler = getattr(__import__(module, fromlist=[name]), name)(**config)
+    if level is not None:
+        handler.setLevel(logging._checkLevel(level))
+    return handler
@@ -0,0 +1,229 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供进程内的统计工具，以及Prometheus文本格式的`/metrics`。
+
+```python
+requests = metrics.counter('rest_requests_total', '请求数', ('operation',))
+requests.labels('VmService.get_vm').inc()
+```
+
+统计只在IOLoop线程中更新，不加锁。
+
+其他模块已有的统计（例如连接池的`stats()`）通过`add_collector`注册，
+在请求`/metrics`时才读取。
+
+"""
+import bisect
+import math
+
+import tornado.web
+
+__author__ = 'cuigang@easted.com.cn'
+
+DEFAULT_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, labels):
+        return [('', labels, self.value)]
+
+
+class Gauge(object):
+    """
+    :param fn: 读取值的函数，设置后`set`、`inc`无效
+    """
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self, labels):
+        return [('', labels, self.fn() if self.fn else self.value)]
+
+
+class Histogram(object):
+    """
+    固定分桶的直方图，用于统计耗时（秒）。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """
+        :return: 累计的分桶计数，最后一个桶是`+Inf`
+        """
+        rs = []
+        total = 0
+        for le, c in zip(self.buckets + ('+Inf',), self.counts):
+            total += c
+            rs.append((le, total))
+        return {
+            'buckets': rs,
+            'sum': self.sum,
+            'count': self.count
+        }
+
+    def samples(self, labels):
+        return histogram_samples(self.snapshot(), labels)
+
+
+def histogram_samples(snapshot, labels):
+    """
+    把`Histogram.snapshot`的结果转换成Prometheus的样本。
+    """
+    rs = []
+    for le, c in snapshot['buckets']:
+        rs.append(('_bucket', labels + [('le', le)], c))
+    rs.append(('_sum', labels, snapshot['sum']))
+    rs.append(('_count', labels, snapshot['count']))
+    return rs
+
+
+class Family(object):
+    """
+    同一个名字、不同label值的一组统计。
+    """
+
+    def __init__(self, name, kind, doc, labelnames, factory):
+        self.name = name
+        self.kind = kind
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('%s expects labels %s' % (
+                    self.name, self.labelnames))
+            child = self._children[values] = self.factory()
+        return child
+
+    def collect(self):
+        samples = []
+        for values, child in sorted(self._children.items()):
+            samples.extend(child.samples(zip(self.labelnames, values)))
+        return self.name, self.kind, self.doc, samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+
+    def _family(self, name, kind, doc, labelnames, factory):
+        family = self._families.get(name)
+        if family is None:
+            family = Family(name, kind, doc, labelnames, factory)
+            self._families[name] = family
+        elif family.kind != kind:
+            raise ValueError('%s is already a %s' % (name, family.kind))
+        return family
+
+    def counter(self, name, doc, labelnames=()):
+        return self._family(name, 'counter', doc, labelnames, Counter)
+
+    def gauge(self, name, doc, labelnames=()):
+        return self._family(name, 'gauge', doc, labelnames, Gauge)
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._family(name, 'histogram', doc, labelnames,
+                            lambda: Histogram(buckets))
+
+    def add_collector(self, fn):
+        """
+        :param fn: 返回`(name, kind, doc, samples)`列表的函数，
+                   samples的每一项是`(后缀, [(label, 值)], 值)`
+        """
+        self._collectors.append(fn)
+
+    def collect(self):
+        rs = [f.collect() for f in self._families.values()]
+        for fn in self._collectors:
+            rs.extend(fn())
+        rs.sort(key=lambda f: f[0])
+        return rs
+
+    def render(self):
+        """
+        :return: Prometheus文本格式（0.0.4）
+        """
+        lines = []
+        for name, kind, doc, samples in self.collect():
+            lines.append('# HELP %s %s' % (name, _escape(doc, False)))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                if labels:
+                    lines.append('%s%s{%s} %s' % (
+                        name, suffix,
+                        ','.join('%s="%s"' % (k, _escape(v))
+                                 for k, v in labels),
+                        _format_value(value)))
+                else:
+                    lines.append('%s%s %s' % (name, suffix,
+                                              _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _escape(value, quote=True):
+    if isinstance(value, float):
+        return _format_value(value)
+    value = '%s' % value
+    value = value.replace('\\', r'\\').replace('\n', r'\n')
+    if quote:
+        value = value.replace('"', r'\"')
+    return value
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return '%s' % value
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """ Prometheus抓取的入口 """
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(REGISTRY.render())
@@ -0,0 +1,397 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块根据装饰器的`params`参数，把path、query和json body中的值转换为指定的类型，
+检查不通过时返回400，被装饰的方法不会执行。
+
+```python
+class Service(RestHandler):
+    @gen.coroutine
+    @get(_path='/vm/{id}?<limit>&<state>&<detail>', params={
+        'id': Int(min=1),
+        'limit': Int(default=20, min=1, max=1000),
+        'state': Enum('running', 'stopped'),
+        'detail': Bool(default=False),
+    })
+    def show(self, id, limit, state, detail):
+        ...
+```
+
+- 参数按名字依次从path、query、json body（body是对象时）中查找；
+- query中的值是字符串，按类型转换；body中的值必须已经是对应的类型；
+- 缺少的参数使用`default`，没有`default`且`required=True`时返回400，否则是None；
+- 没有在`params`中声明的参数和原来一样，取query中的原始字符串，
+  没有时使用方法参数的默认值或者None。
+
+`params`在装饰时编译为`Binder`，请求时不再分析方法的参数。
+
+"""
+import inspect
+import re
+
+import tornado.web
+from tornado.escape import to_unicode
+
+__author__ = 'cuigang@easted.com.cn'
+
+_MISSING = object()
+
+_TRUE = frozenset(['1', 'true', 'yes', 'on'])
+_FALSE = frozenset(['0', 'false', 'no', 'off'])
+
+
+class ParamError(tornado.web.HTTPError):
+    def __init__(self, name, msg):
+        super(ParamError, self).__init__(
+            400, 'Invalid parameter %s: %s', name, msg)
+        self.name = name
+        self.msg = msg
+
+    def __str__(self):
+        return 'Invalid parameter %s: %s' % (self.name, self.msg)
+
+
+class Invalid(ValueError):
+    """ 值的类型正确，但是没有通过检查 """
+
+
+class Param(object):
+    """
+    每种类型在编译时生成转换函数，只包含设置了的检查。
+
+    :param default: 缺少时的值
+    :param required: 没有`default`时是否必须提供
+    """
+    # 转换失败（不是`Invalid`）时的错误信息
+    message = 'is invalid'
+    multiple = False
+
+    def __init__(self, default=_MISSING, required=False):
+        self.default = default
+        self.required = required
+
+    def parser(self):
+        """ :return: 把query中的字符串转换为值的函数，失败时抛出ValueError """
+        raise NotImplementedError()
+
+    def json_parser(self):
+        """ :return: 检查body中的值的函数，失败时抛出ValueError """
+        raise NotImplementedError()
+
+
+def _ranged(convert, lo, hi):
+    if lo is None and hi is None:
+        return convert
+
+    def parse(value):
+        value = convert(value)
+        if lo is not None and value < lo:
+            raise Invalid('must be >= %s' % lo)
+        if hi is not None and value > hi:
+            raise Invalid('must be <= %s' % hi)
+        return value
+
+    return parse
+
+
+def _sized(convert, lo, hi, unit):
+    if lo is None and hi is None:
+        return convert
+
+    def parse(value):
+        value = convert(value)
+        if lo is not None and len(value) < lo:
+            raise Invalid('must have at least %d %s' % (lo, unit))
+        if hi is not None and len(value) > hi:
+            raise Invalid('must have at most %d %s' % (hi, unit))
+        return value
+
+    return parse
+
+
+class Int(Param):
+    message = 'must be an integer'
+
+    def __init__(self, min=None, max=None, **kwargs):
+        super(Int, self).__init__(**kwargs)
+        self.min = min
+        self.max = max
+
+    def parser(self):
+        return _ranged(int, self.min, self.max)
+
+    def json_parser(self):
+        def convert(value):
+            if isinstance(value, bool) or not isinstance(value, (int, long)):
+                raise ValueError()
+            return value
+
+        return _ranged(convert, self.min, self.max)
+
+
+class Float(Int):
+    message = 'must be a number'
+
+    def parser(self):
+        return _ranged(float, self.min, self.max)
+
+    def json_parser(self):
+        def convert(value):
+            if isinstance(value, bool) or not isinstance(
+                    value, (int, long, float)):
+                raise ValueError()
+            return float(value)
+
+        return _ranged(convert, self.min, self.max)
+
+
+class Str(Param):
+    """
+    :param pattern: 正则表达式，必须完全匹配
+    """
+    message = 'must be an utf-8 string'
+
+    def __init__(self, min_len=None, max_len=None, pattern=None, **kwargs):
+        super(Str, self).__init__(**kwargs)
+        self.min_len = min_len
+        self.max_len = max_len
+        self.pattern = pattern
+
+    def _checked(self, convert):
+        convert = _sized(convert, self.min_len, self.max_len, 'characters')
+        if self.pattern is None:
+            return convert
+        match = re.compile(self.pattern + r'\Z').match
+        pattern = self.pattern
+
+        def parse(value):
+            value = convert(value)
+            if not match(value):
+                raise Invalid('must match %s' % pattern)
+            return value
+
+        return parse
+
+    def parser(self):
+        # query中的值是bytes，path中的值tornado已经解码为unicode；
+        # UnicodeDecodeError是ValueError的子类
+        return self._checked(to_unicode)
+
+    def json_parser(self):
+        def convert(value):
+            if not isinstance(value, basestring):
+                raise ValueError()
+            return to_unicode(value)
+
+        return self._checked(convert)
+
+
+class Bool(Param):
+    message = 'must be a boolean'
+
+    def parser(self):
+        def parse(value):
+            value = value.lower()
+            if value in _TRUE:
+                return True
+            if value in _FALSE:
+                return False
+            raise ValueError()
+
+        return parse
+
+    def json_parser(self):
+        def parse(value):
+            if not isinstance(value, bool):
+                raise ValueError()
+            return value
+
+        return parse
+
+
+class Enum(Param):
+    message = 'must be a string'
+
+    def __init__(self, *choices, **kwargs):
+        super(Enum, self).__init__(**kwargs)
+        self.choices = frozenset(choices)
+
+    def parser(self):
+        choices = self.choices
+        msg = 'must be one of %s' % ', '.join(sorted(choices))
+
+        def parse(value):
+            if value not in choices:
+                raise Invalid(msg)
+            return value
+
+        return parse
+
+    def json_parser(self):
+        return self.parser()
+
+
+class List(Param):
+    """
+    query中可以是多个同名参数（`?id=1&id=2`），也可以是`sep`分隔的一个参数；
+    body中必须是数组。转换后是tuple。
+
+    :param item: 元素的类型，例如`Int()`
+    """
+    multiple = True
+
+    def __init__(self, item, sep=',', min_len=None, max_len=None, **kwargs):
+        super(List, self).__init__(**kwargs)
+        self.item = item
+        self.sep = sep
+        self.min_len = min_len
+        self.max_len = max_len
+        self.message = 'items %s' % item.message
+
+    def _items(self, convert):
+        def parse(values):
+            try:
+                return tuple([convert(v) for v in values])
+            except Invalid as e:
+                raise Invalid('items %s' % e)
+
+        return _sized(parse, self.min_len, self.max_len, 'items')
+
+    def parser(self):
+        parse = self._items(self.item.parser())
+        sep = self.sep
+        if not sep:
+            return parse
+
+        def split(values):
+            if len(values) == 1:
+                values = [v for v in values[0].split(sep) if v]
+            return parse(values)
+
+        return split
+
+    def json_parser(self):
+        parse = self._items(self.item.json_parser())
+
+        def convert(value):
+            if not isinstance(value, list):
+                raise ValueError()
+            return parse(value)
+
+        return convert
+
+
+def _converter(name, param, in_path):
+    """ :return: `convert(url_values, arguments, body)`，返回参数的值 """
+    parse = param.parser()
+    parse_json = param.json_parser()
+    message = param.message
+    default = param.default
+    multiple = param.multiple
+    required = param.required
+
+    def fail(e):
+        if isinstance(e, Invalid):
+            return ParamError(name, e)
+        return ParamError(name, message)
+
+    if in_path is not None:
+        def convert(url_values, arguments, body):
+            value = url_values[in_path]
+            try:
+                return parse([value] if multiple else value)
+            except ValueError as e:
+                raise fail(e)
+
+        return convert
+
+    def convert(url_values, arguments, body):
+        values = arguments.get(name)
+        try:
+            if values:
+                return parse(values if multiple else values[0])
+            if body is not None:
+                value = body.get(name)
+                if value is not None:
+                    return parse_json(value)
+        except ValueError as e:
+            raise fail(e)
+        if default is not _MISSING:
+            return default
+        if required:
+            raise ParamError(name, 'is required')
+        return None
+
+    return convert
+
+
+def _raw(name, index, default):
+    """ 没有声明类型的参数，和原来一样取query中的字符串 """
+    if index is not None:
+        return lambda url_values, arguments, body: url_values[index]
+
+    def convert(url_values, arguments, body):
+        values = arguments.get(name)
+        if values:
+            return values[0]
+        return default
+
+    return convert
+
+
+class Binder(object):
+    """
+    由`core.rest.config`创建，按方法的参数顺序生成参数值。
+    """
+
+    def __init__(self, func, path_params, schema):
+        spec = inspect.getargspec(func)
+        names = spec.args[1:]
+        defaults = dict(zip(reversed(spec.args), reversed(spec.defaults or ())))
+        unknown = set(schema) - set(names)
+        if unknown:
+            raise ValueError('params not in the arguments of %s: %s' % (
+                func.__name__, ', '.join(sorted(unknown))))
+        self.names = names
+        self.converters = []
+        # 没有query和body时（常见的情况），只需要转换path中的参数
+        self.path_converters = []
+        self.empty = []
+        self.required = None
+        for i, name in enumerate(names):
+            in_path = None
+            if name in path_params:
+                in_path = path_params.index(name)
+            param = schema.get(name)
+            if param is not None:
+                convert = _converter(name, param, in_path)
+                default = param.default if param.default is not _MISSING \
+                    else None
+                if (in_path is None and param.required and
+                        param.default is _MISSING and self.required is None):
+                    self.required = name
+            else:
+                convert = _raw(name, in_path, defaults.get(name))
+                default = defaults.get(name)
+            self.converters.append(convert)
+            self.empty.append(default)
+            if in_path is not None:
+                self.path_converters.append((i, convert))
+
+    def bind(self, url_values, arguments, body=None):
+        """
+        :param body: 解析后的json body，不是对象时忽略
+        :return: 方法的参数值（不包括self）
+        """
+        if not isinstance(body, dict):
+            body = None
+        if not arguments and body is None:
+            if self.required is not None:
+                raise ParamError(self.required, 'is required')
+            values = list(self.empty)
+            for i, convert in self.path_converters:
+                values[i] = convert(url_values, arguments, body)
+            return values
+        return [c(url_values, arguments, body) for c in self.converters]
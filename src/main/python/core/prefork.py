@@ -0,0 +1,227 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供生产环境的多进程（pre-fork）运行方式。
+
+主进程只负责启动和监控worker进程，不处理请求：
+
+- worker异常退出后自动重新启动；启动后`min_uptime`秒内就退出时，
+  等待1、2、4...秒（最多`max_backoff`秒）再启动，同一个worker连续
+  `max_fast_failures`次这样退出时，停止所有worker并抛出`CrashLoop`；
+- 收到`SIGHUP`时逐个平滑重启所有worker；
+- 收到`SIGTERM`或`SIGINT`时通知所有worker平滑退出，然后自己退出。
+
+每个worker使用`SO_REUSEPORT`各自监听端口，由内核分配连接；平台不支持时，
+在fork之前监听，由所有worker共享。
+
+worker收到`SIGTERM`后停止接受新连接，等待正在处理的请求结束（最多`drain_timeout`秒）
+后退出。
+
+"""
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+__author__ = 'cuigang@easted.com.cn'
+
+LOG = logging.getLogger('system')
+
+
+class CrashLoop(RuntimeError):
+    """ worker启动后总是很快退出，重新启动也没有用 """
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def run(start_worker, port, num_processes=0, min_uptime=5, max_backoff=60,
+        max_fast_failures=10):
+    """
+    启动worker进程并监控，直到收到退出的信号，只在主进程中返回。
+
+    :param start_worker: 参数为(task_id, sockets)的函数，在worker进程中调用，
+                         需要启动IOLoop，IOLoop停止后worker退出
+    :param port: 监听的端口
+    :param num_processes: worker的数量，0表示cpu的个数
+    :param min_uptime: 运行不到这些秒数就退出的worker延迟重新启动
+    :param max_backoff: 重新启动前最多等待的秒数
+    :param max_fast_failures: 一个worker连续这些次很快退出时，主进程退出
+    :raise CrashLoop: worker连续`max_fast_failures`次很快退出
+    """
+    if num_processes <= 0:
+        num_processes = cpu_count()
+
+    shared = None
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        shared = bind_sockets(port)
+
+    children = {}
+    retiring = set()
+    state = {'stopping': False, 'restart': False, 'crashed': None}
+    # task_id: 启动的时间、连续很快退出的次数、延迟重新启动的时间
+    started = {}
+    failures = {}
+    pending = {}
+
+    def spawn(task_id):
+        started[task_id] = time.time()
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            code = 0
+            try:
+                sockets = shared
+                if sockets is None:
+                    sockets = bind_sockets(port, reuse_port=True)
+                start_worker(task_id, sockets)
+            except BaseException:
+                LOG.exception('worker %d failed', task_id)
+                code = 1
+            finally:
+                # os._exit不执行atexit，先写出日志队列和缓冲中的记录
+                try:
+                    logging.shutdown()
+                finally:
+                    os._exit(code)
+        children[pid] = task_id
+        LOG.info('worker %d started, pid %d', task_id, pid)
+
+    def on_stop(sig, frame):
+        state['stopping'] = True
+
+    def on_restart(sig, frame):
+        state['restart'] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_restart)
+
+    for i in range(num_processes):
+        spawn(i)
+
+    def exited(task_id, pid, status):
+        uptime = time.time() - started[task_id]
+        if uptime >= min_uptime:
+            failures[task_id] = 0
+            LOG.warn('worker %d (pid %d) exited with status %d, restarting',
+                     task_id, pid, status)
+            spawn(task_id)
+            return
+        failures[task_id] = failures.get(task_id, 0) + 1
+        if failures[task_id] >= max_fast_failures:
+            LOG.error('worker %d exited %d times in a row within %ss, '
+                      'stopping', task_id, failures[task_id], min_uptime)
+            state['crashed'] = task_id
+            state['stopping'] = True
+            return
+        delay = min(max_backoff, 2 ** (failures[task_id] - 1))
+        LOG.warn('worker %d (pid %d) exited with status %d after %.1fs, '
+                 'restarting in %ds', task_id, pid, status, uptime, delay)
+        pending[task_id] = time.time() + delay
+
+    stopped = False
+    while children or (pending and not stopped):
+        if state['stopping'] and not stopped:
+            stopped = True
+            pending.clear()
+            LOG.info('stopping %d workers', len(children))
+            for pid in children:
+                _kill(pid)
+        if state['restart'] and not stopped:
+            state['restart'] = False
+            _rolling_restart(children, retiring, spawn)
+        now = time.time()
+        for task_id, due in pending.items():
+            if due <= now and not stopped:
+                del pending[task_id]
+                spawn(task_id)
+
+        if not children:
+            time.sleep(0.2)
+            continue
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+
+        task_id = children.pop(pid)
+        if pid in retiring:
+            retiring.discard(pid)
+            LOG.info('worker %d (pid %d) retired', task_id, pid)
+        elif not stopped:
+            exited(task_id, pid, status)
+
+    if state['crashed'] is not None:
+        raise CrashLoop('worker %d keeps exiting at startup' %
+                        state['crashed'])
+
+
+def _rolling_restart(children, retiring, spawn):
+    """
+    先启动新的worker，再让旧的worker平滑退出，监听的端口一直有worker在处理。
+    """
+    for pid, task_id in list(children.items()):
+        if pid in retiring:
+            continue
+        retiring.add(pid)
+        spawn(task_id)
+        _kill(pid)
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def install_drain(server, in_flight, drain_timeout=10):
+    """
+    在worker中调用，收到`SIGTERM`后停止接受新连接，
+    等待正在处理的请求结束后停止IOLoop。
+
+    :param server: HTTPServer
+    :param in_flight: 返回正在处理的请求数的函数
+    :param drain_timeout: 最多等待的时间（秒）
+    """
+    io_loop = IOLoop.current()
+
+    def drain():
+        server.stop()
+        deadline = io_loop.time() + drain_timeout
+
+        def check():
+            if in_flight() == 0 or io_loop.time() >= deadline:
+                if in_flight():
+                    LOG.warn('stopped with %d requests in flight', in_flight())
+                io_loop.stop()
+            else:
+                io_loop.call_later(0.1, check)
+
+        check()
+
+    def on_signal(sig, frame):
+        io_loop.add_callback_from_signal(drain)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
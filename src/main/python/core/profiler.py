@@ -0,0 +1,286 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供运行时开关的性能分析，不需要重新部署：
+
+- `Sampler`：后台线程定时读取IOLoop线程的堆栈，输出flamegraph使用的collapsed stacks，
+  每个堆栈以正在处理的操作（`类名.方法名`）开头；
+- `profile_operation`：对某个操作按比例抽取请求，用cProfile记录，结果合并后
+  可以下载为pstats文件。cProfile只在这个请求的回调执行时启用，
+  同时处理的其他请求不会计入，参见`core.context`。
+
+通过`ProfilerHandler`管理（只允许settings中`admin_ips`的地址访问，默认本机）：
+
+```
+GET    /admin/profiler                          # 状态
+POST   /admin/profiler/sampler                  # 开始采样，body: {"interval": 0.005}
+DELETE /admin/profiler/sampler                  # 停止采样
+GET    /admin/profiler/sampler                  # 下载collapsed stacks
+POST   /admin/profiler/profiles                 # body: {"target": "GET /vm/{id}", "rate": 0.1}
+DELETE /admin/profiler/profiles?target=...      # 停止记录
+GET    /admin/profiler/profiles?target=...      # 下载pstats文件
+```
+
+target可以是`类名.方法名`，也可以是`方法 路径`，路径和装饰器的`_path`相同。
+
+"""
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import random
+import sys
+import thread
+import threading
+import time
+
+import tornado.web
+
+from core import context
+
+__author__ = 'cuigang@easted.com.cn'
+
+_sampler = None
+
+# target -> OperationProfile
+_profiles = {}
+
+
+class Sampler(object):
+    """
+    :param thread_id: 被采样的线程，默认是创建Sampler的线程（IOLoop线程）
+    :param interval: 采样间隔（秒）
+    :param max_stacks: 最多记录的不同堆栈数，超过后计入`(other)`
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_stacks=10000):
+        self.thread_id = thread_id or thread.get_ident()
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.started = None
+        self.counts = {}
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self.started = time.time()
+        worker = threading.Thread(target=self._run, name='profiler-sampler')
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.sample(frame, context.context_of(self.thread_id))
+
+    def sample(self, frame, ctx=None):
+        stack = collapse(frame)
+        if ctx is not None and ctx.operation is not None:
+            stack = ctx.operation + ';' + stack
+        counts = self.counts
+        if stack not in counts and len(counts) >= self.max_stacks:
+            stack = '(other)'
+        counts[stack] = counts.get(stack, 0) + 1
+        self.samples += 1
+
+    def collapsed(self):
+        """
+        :return: 每行一个堆栈和它的采样数，`flamegraph.pl`可以直接使用
+        """
+        lines = ['%s %d' % (s, n) for s, n in sorted(self.counts.items())]
+        lines.append('')
+        return '\n'.join(lines)
+
+    def stats(self):
+        return {
+            'running': self._running,
+            'interval': self.interval,
+            'started': self.started,
+            'samples': self.samples,
+            'stacks': len(self.counts)
+        }
+
+
+def collapse(frame):
+    """
+    :return: 从最外层到frame的函数，`函数 (文件名)`，以`;`分隔
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s)' % (code.co_name,
+                                  os.path.basename(code.co_filename)))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+def start_sampler(interval=0.005, thread_id=None):
+    """ 开始采样，之前的结果被丢弃 """
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+    _sampler = Sampler(thread_id, interval)
+    _sampler.start()
+    return _sampler
+
+
+def stop_sampler():
+    if _sampler is not None:
+        _sampler.stop()
+    return _sampler
+
+
+class OperationProfile(object):
+    """
+    :param rate: 抽取的比例，1表示每个请求
+    :param max_requests: 最多记录的请求数，达到后自动停止
+    """
+
+    def __init__(self, target, rate=0.1, max_requests=1000):
+        self.target = target
+        self.rate = rate
+        self.max_requests = max_requests
+        self.requests = 0
+        self.stats = None
+
+    @property
+    def running(self):
+        return self.requests < self.max_requests
+
+    def add(self, profile):
+        self.requests += 1
+        profile.create_stats()
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def dumps(self):
+        """ :return: pstats文件的内容，`pstats.Stats(filename)`可以读取 """
+        if self.stats is None:
+            return marshal.dumps({})
+        return marshal.dumps(self.stats.stats)
+
+    def to_dict(self):
+        return {
+            'target': self.target,
+            'rate': self.rate,
+            'max_requests': self.max_requests,
+            'requests': self.requests
+        }
+
+
+def profile_operation(target, rate=0.1, max_requests=1000):
+    """
+    :param target: `类名.方法名`或者`方法 路径`，例如`GET /vm/{id}`
+    """
+    p = _profiles[target] = OperationProfile(target, rate, max_requests)
+    return p
+
+
+def stop_profile(target):
+    """ 停止记录，已经记录的结果仍然可以下载 """
+    p = _profiles.get(target)
+    if p is not None:
+        p.max_requests = p.requests
+    return p
+
+
+def maybe_profile(ctx, operation, method, path):
+    """
+    由`RestHandler._exe`在确定了操作之后调用，按比例决定是否记录这个请求。
+    """
+    if not _profiles:
+        return
+    p = _profiles.get(operation) or _profiles.get('%s %s' % (method, path))
+    if p is None or not p.running or random.random() >= p.rate:
+        return
+    ctx.profile = cProfile.Profile()
+    ctx.profile_target = p
+    # 当前已经在上下文中，之后由上下文负责启用和停止
+    ctx.profile.enable()
+
+
+def finish_profile(ctx):
+    """ 请求结束时调用，合并结果 """
+    profile = ctx.profile
+    if profile is None:
+        return
+    profile.disable()
+    ctx.profile = None
+    ctx.profile_target.add(profile)
+
+
+def _allowed(handler):
+    return handler.request.remote_ip in handler.settings.get(
+        'admin_ips', ('127.0.0.1', '::1'))
+
+
+class ProfilerHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        if not _allowed(self):
+            raise tornado.web.HTTPError(403)
+
+    def _body(self):
+        if self.request.body:
+            return json.loads(self.request.body)
+        return {}
+
+    def get(self, part=None):
+        if part == 'sampler':
+            if _sampler is None:
+                raise tornado.web.HTTPError(404)
+            self.set_header('Content-Type', 'text/plain; charset=utf-8')
+            self.set_header('Content-Disposition',
+                            'attachment; filename="stacks.collapsed"')
+            self.write(_sampler.collapsed())
+        elif part == 'profiles':
+            p = _profiles.get(self.get_argument('target'))
+            if p is None:
+                raise tornado.web.HTTPError(404)
+            self.set_header('Content-Type', 'application/octet-stream')
+            self.set_header('Content-Disposition',
+                            'attachment; filename="operation.pstats"')
+            self.write(p.dumps())
+        else:
+            self.write({
+                'sampler': _sampler.stats() if _sampler else None,
+                'profiles': [p.to_dict() for p in _profiles.values()]
+            })
+
+    def post(self, part=None):
+        body = self._body()
+        if part == 'sampler':
+            # 在IOLoop线程中调用，默认采样这个线程
+            self.write(start_sampler(body.get('interval', 0.005)).stats())
+        elif part == 'profiles':
+            p = profile_operation(body['target'], body.get('rate', 0.1),
+                                  body.get('max_requests', 1000))
+            self.write(p.to_dict())
+        else:
+            raise tornado.web.HTTPError(405)
+
+    def delete(self, part=None):
+        if part == 'sampler':
+            sampler = stop_sampler()
+            self.write(sampler.stats() if sampler else {})
+        elif part == 'profiles':
+            p = stop_profile(self.get_argument('target'))
+            self.write(p.to_dict() if p else {})
+        else:
+            raise tornado.web.HTTPError(405)
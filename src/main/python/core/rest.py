@@ -1,14 +1,26 @@
 # coding=utf-8
 import abc
 import inspect
-import json
 import logging
 import re
+import time
 import types
 
 import tornado.web
 from tornado import gen
+from tornado.concurrent import is_future
+from tornado.escape import url_unescape, utf8
+from tornado.iostream import StreamClosedError
 from common import trace
+from core import http_cache, metrics, profiler
+from core.admission import Admission, Rejected
+from core.base import ServiceBusy
+from core.codec import JSONCodec, get_codec
+from core.context import RequestContext
+from core.executor import Offload
+from core.filters import FilterChain
+from core.params import Binder, ParamError
+from core.router import RouteTable, rule_order
 
 __author__ = 'cuigang@easted.com.cn'
 
@@ -24,6 +36,16 @@ __author__ = 'cuigang@easted.com.cn'
 2. 不再把body作为最后一个参数传递给处理请求的方法。需要从方法的**kwargs参数中获取body。或者
    自己通过self.request.body获取。
 3. 提供request filter chain。filter是一个参数为request对象的方法，可以是协程。
+   filter可以声明依赖、限定path和方法，没有依赖关系的filter同时执行，参见`core.filters`。
+4. `@get`的`cache_ttl`参数缓存编码后的响应，支持`ETag`和304；`coalesce=True`合并
+   并发的相同请求，不缓存。参见`core.http_cache`。
+5. 装饰器的`executor`参数把操作放到线程池/进程池中执行，参见`core.executor`。
+6. 统计每个操作各阶段的耗时、SQL的耗时和条数，由`core.metrics.MetricsHandler`输出。
+7. 装饰器的`params`参数声明参数的类型、默认值和范围，不符合时返回400，参见`core.params`。
+8. 装饰器的`rate_limit`、`max_in_flight`参数限制请求速率和并发数，超过时返回429/503，
+   参见`core.admission`。
+9. settings中设置`batch_path`时`RestService`提供批量接口，一个请求中执行多个操作，
+   参见`core.batch`。
 
 被装饰的方法返回值
 ---
@@ -32,6 +54,11 @@ __author__ = 'cuigang@easted.com.cn'
 
 其他形式将作为data直接响应给前台，total设置为1.
 
+返回generator或者带有`next_batch`协程方法的对象（如`DBUtil.iterate`的返回值）时，
+以chunked方式逐行输出，内存中只保留`stream_flush_rows`行（settings，默认1000）。
+total在最后输出；也可以返回`(rows, total)`预先给出total。
+`next_batch`每次返回一批行，返回空列表表示结束。
+
 """
 
 __all__ = [
@@ -45,20 +72,108 @@ __all__ = [
 
 LOG = logging.getLogger('system')
 
-_filter = []
+_filter = FilterChain()
 _prepares = []
-
-
-def add_filter(func):
+_default_codec = JSONCodec()
+_in_flight = 0
+
+
+def add_filter(func, depends=(), paths=None, methods=None, name=None,
+               batch_once=False):
+    """
+    :param depends: 依赖的filter的名字，在它们完成之后执行
+    :param paths: 正则表达式，从请求的path开头匹配，不匹配时跳过
+    :param methods: 只在这些http方法时执行
+    :param name: filter的名字，默认是函数名
+    :param batch_once: `/batch`中只对整个batch执行一次，参见`core.filters`
+    """
     assert isinstance(func, types.FunctionType)
-    _filter.append(func)
+    _filter.add(func, depends, paths, methods, name, batch_once)
 
 
 def add_prepare(func):
+    """ func可以是协程，多个prepare返回的Future同时等待 """
     assert isinstance(func, types.FunctionType)
     _prepares.append(func)
 
 
+def in_flight_requests():
+    """ 当前进程中正在处理的请求数 """
+    return _in_flight
+
+
+metrics.gauge(
+    'rest_requests_in_flight', 'Requests being processed by this process.'
+).labels().fn = in_flight_requests
+
+_operation_in_flight = metrics.gauge(
+    'rest_operation_in_flight', 'Requests being processed by operation.',
+    ('operation',))
+_requests = metrics.counter(
+    'rest_requests_total', 'Finished requests by operation and status code.',
+    ('operation', 'code'))
+_request_seconds = metrics.histogram(
+    'rest_request_seconds', 'Total time of a request.', ('operation',))
+_phase_seconds = metrics.histogram(
+    'rest_phase_seconds',
+    'Time spent in each phase of an operation: filters, decode, params, '
+    'handler, encode and write.',
+    ('operation', 'phase'))
+_db_seconds = metrics.histogram(
+    'rest_request_db_seconds', 'Time spent executing SQL per request.',
+    ('operation',))
+_db_queries = metrics.histogram(
+    'rest_request_db_queries', 'SQL statements executed per request.',
+    ('operation',), buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+
+_PHASES = ('filters', 'decode', 'params', 'handler', 'encode', 'write')
+
+
+class OperationMetrics(object):
+    """
+    一个操作的统计，label只在创建时查找一次。
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.phases = dict(
+            (p, _phase_seconds.labels(operation, p)) for p in _PHASES)
+        self.in_flight = _operation_in_flight.labels(operation)
+        self.request_seconds = _request_seconds.labels(operation)
+        self.db_seconds = _db_seconds.labels(operation)
+        self.db_queries = _db_queries.labels(operation)
+        self.codes = {}
+
+    def phase(self, name, start):
+        """
+        :return: 当前时间，作为下一个阶段的开始时间
+        """
+        now = time.time()
+        self.phases[name].observe(now - start)
+        return now
+
+    def finished(self, code, seconds, context):
+        counter = self.codes.get(code)
+        if counter is None:
+            counter = self.codes[code] = _requests.labels(
+                self.operation, str(code))
+        counter.inc()
+        self.request_seconds.observe(seconds)
+        self.db_seconds.observe(context.db_time)
+        self.db_queries.observe(context.db_queries)
+
+
+_operation_metrics = {}
+
+
+def operation_metrics(cls, name):
+    m = _operation_metrics.get((cls, name))
+    if m is None:
+        m = OperationMetrics('%s.%s' % (cls.__name__, name))
+        _operation_metrics[(cls, name)] = m
+    return m
+
+
 def config(func, method, **kwparams):
     path = None
     required = None
@@ -66,12 +181,49 @@ def config(func, method, **kwparams):
     if len(kwparams):
         path = kwparams['_path']
 
-    def operation(*args, **kwargs):
-        return func(*args, **kwargs)
+    executor = kwparams.get('executor')
+    if executor is not None:
+        # 在线程池/进程池中执行，参见core.executor
+        offload = Offload(func, executor, '%s %s' % (method, path),
+                          kwparams.get('max_concurrency'))
+
+        def operation(*args, **kwargs):
+            return offload(*args, **kwargs)
+    else:
+        def operation(*args, **kwargs):
+            return func(*args, **kwargs)
 
     operation.func_name = func.__name__
+    operation._func = func
+    operation._cache = None
+    if kwparams.get('cache_ttl'):
+        # 缓存编码后的响应，参见core.http_cache
+        if method != 'GET':
+            raise ValueError('cache_ttl can only be used with @get')
+        operation._cache = http_cache.ResponseCache(
+            kwparams['cache_ttl'], kwparams.get('cache_args'),
+            kwparams.get('cache_headers', ()))
+    elif kwparams.get('coalesce'):
+        # 只合并并发的相同请求，参见core.http_cache
+        if method != 'GET':
+            raise ValueError('coalesce can only be used with @get')
+        operation._cache = http_cache.Coalescer(
+            kwparams.get('cache_args'), kwparams.get('cache_headers', ()))
     operation._func_params = inspect.getargspec(func).args[1:]
     operation._service_params = re.findall(r"(?<={)\w+", path)
+    operation._arg_params = [p for p in operation._func_params
+                             if p not in operation._service_params]
+    operation._admission = None
+    if kwparams.get('rate_limit') or kwparams.get('max_in_flight'):
+        # 限制速率和并发，参见core.admission
+        operation._admission = Admission(
+            '%s %s' % (method, path), kwparams.get('rate_limit'),
+            kwparams.get('rate_key'), kwparams.get('max_in_flight'),
+            kwparams.get('max_queue', 0), kwparams.get('queue_timeout', 1.0))
+    operation._binder = None
+    if kwparams.get('params'):
+        operation._binder = Binder(func, operation._service_params,
+                                   kwparams['params'])
     operation._service_name = re.findall(r"(?<=/)\w+", path)
     operation._query_params = re.findall(r"(?<=<)\w+", path)
     operation._required = required
@@ -112,32 +264,74 @@ def delete(*params, **kwparams):
 class RestHandler(tornado.web.RequestHandler):
     __metaclass__ = abc.ABCMeta
 
+    def __init__(self, application, request, **kwargs):
+        # 由RestService注册的规则会绑定操作，参见`RouteTable.rules`
+        self._rest_operations = kwargs.pop('_rest_operations', None)
+        self._rest_params = kwargs.pop('_rest_params', ())
+        self._stream_started = False
+        self._counted = False
+        self.context = None
+        self._metrics = None
+        super(RestHandler, self).__init__(application, request, **kwargs)
+
+    @property
+    def codec(self):
+        """ The json codec configured by `json_codec` of RestService """
+        return getattr(self.application, 'json_codec', _default_codec)
+
     def prepare(self):
+        global _in_flight
+        _in_flight += 1
+        self._counted = True
+        futures = None
         for f in _prepares:
-            f(self.request)
+            rs = f(self.request)
+            if is_future(rs):
+                futures = futures or []
+                futures.append(rs)
+        if futures:
+            return gen.multi(futures)
+
+    def on_finish(self):
+        global _in_flight
+        if self._counted:
+            _in_flight -= 1
+            self._counted = False
+        if self.context is not None:
+            profiler.finish_profile(self.context)
+        if self._metrics is not None:
+            self._metrics.finished(self.get_status(),
+                                   self.request.request_time(), self.context)
 
     @gen.coroutine
-    def get(self):
+    def get(self, **path_kwargs):
         """ Executes get method """
-        yield self._exe('GET')
+        yield self._run('GET', path_kwargs)
 
     @gen.coroutine
-    def post(self):
+    def post(self, **path_kwargs):
         """ Executes post method """
-        yield self._exe('POST')
+        yield self._run('POST', path_kwargs)
 
     @gen.coroutine
-    def put(self):
+    def put(self, **path_kwargs):
         """ Executes put method"""
-        yield self._exe('PUT')
+        yield self._run('PUT', path_kwargs)
 
     @gen.coroutine
-    def delete(self):
+    def delete(self, **path_kwargs):
         """ Executes put method"""
-        yield self._exe('DELETE')
+        yield self._run('DELETE', path_kwargs)
+
+    def _run(self, method, path_kwargs):
+        """
+        在请求的上下文中执行`_exe`，参见`core.context`。
+        """
+        self.context = RequestContext()
+        return self.context.run(self._exe, method, path_kwargs)
 
     @gen.coroutine
-    def _exe(self, method):
+    def _exe(self, method, path_kwargs):
 
         res = {
             "success": True,
@@ -147,79 +341,271 @@ class RestHandler(tornado.web.RequestHandler):
         }
 
         """ Executes the python function for the Rest Service """
-        request_path = self.request.path
-        path = request_path.split('/')
-        services_and_params = list(filter(lambda x: x != '', path))
-
-        # Get all function names configured in the class RestHandler
-        functions = list(filter(
-            lambda op: hasattr(
-                getattr(self, op),
-                '_service_name'
-            ) is True and inspect.ismethod(
-                getattr(self, op)
-            ) is True, dir(self)))
-        # Get all http methods configured in the class RestHandler
-        http_methods = list(
-            map(lambda op: getattr(getattr(self, op), '_method'), functions))
-
-        if method not in http_methods:
-            raise tornado.web.HTTPError(
-                405, 'The service not have %s verb' % method
-            )
-
-        for operation in list(map(lambda op: getattr(self, op), functions)):
-            service_name = getattr(operation, "_service_name")
-            service_params = getattr(operation, "_service_params")
-
-            # If the _types is not specified, assumes str types for the params
-            services_from_request = list(
-                filter(lambda x: x in path, service_name))
-
-            op_m_eq_req_m = operation._method == self.request.method
-            s_name_eq_s_req = service_name == services_from_request
-            len_eq = len(service_params) + len(service_name) == len(
-                services_and_params)
-
-            if op_m_eq_req_m and s_name_eq_s_req and len_eq:
-                try:
-                    for f in _filter:
-                        yield f(self.request)
-                    params_values = self._find_params_value_of_url(
-                        service_name,
-                        request_path
-                    ) + self._find_params_value_of_arguments(operation)
-
-                    p_values = params_values
-
-                    kwargs = {}
-                    if self.request.body:
-                        if 'application/json' in self.request.headers.get_list(
-                                'content-type'):
-                            kwargs['body'] = json.loads(self.request.body)
-
-                    rs = yield operation(*p_values, **kwargs)
-
-                    self.response_decorate(rs, res)
-
-                    self.set_header("Content-Type", 'application/json')
-                    if not self._finished:
-                        self.write(json.dumps(res))
-                    else:
-                        # 有些情况下需要先finish，这时候应该不需要write，比如下载的时候。
-                        LOG.warn('Cannot write() after finish(). boyd:\n %s',
-                                 json.dumps(res, indent=4))
-
-                except Exception as detail:
-                    self.set_header("Content-Type", 'application/json')
-                    LOG.debug("rest frame detail=%s" % detail)
-                    LOG.error(trace())
-                    res['success'] = False
-                    res['msg'] = '%s' % detail
-                    self.write(json.dumps(res))
-                finally:
-                    self.finish()
-        self.send_error(404)
+        if self._rest_operations is not None:
+            name = self._rest_operations.get(method)
+            if name is not None:
+                url_values = [path_kwargs[p] for p in self._rest_params]
+            else:
+                # 静态段的规则没有这个方法时，参数段的操作仍然可能匹配，
+                # 比如`GET /vm/list`和`DELETE /vm/{id}`中的`DELETE /vm/list`
+                found = self.route_table().match(method, self.request.path)
+                if found is None:
+                    raise tornado.web.HTTPError(
+                        405, 'The service not have %s verb' % method
+                    )
+                name, values = found
+                # 和tornado提取的path参数一样解码
+                url_values = [url_unescape(v, plus=False) for v in values]
+        else:
+            # 没有通过RestService注册，比如直接使用了`(pattern, cls)`
+            routes = self.route_table()
+            if method not in routes.methods:
+                raise tornado.web.HTTPError(
+                    405, 'The service not have %s verb' % method
+                )
+            found = routes.match(method, self.request.path)
+            if found is None:
+                self.send_error(404)
+                return
+            name, url_values = found
+
+        operation = getattr(self, name)
+        m = self._metrics = operation_metrics(type(self), name)
+        self.context.operation = m.operation
+        m.in_flight.inc()
+        profiler.maybe_profile(self.context, m.operation, operation._method,
+                               operation._path)
+        admission = getattr(operation, '_admission', None)
+        admitted = False
+        t = time.time()
+        try:
+            if admission is not None:
+                # 在filter之前，超过限制的请求不再占用资源
+                yield admission.admit(self.request)
+                admitted = True
+                # 等待的时间由rest_admission_queue_seconds统计
+                t = time.time()
+            yield _filter.run(self.request)
+            t = m.phase('filters', t)
+
+            kwargs = self._decode_body()
+            t = m.phase('decode', t)
+
+            p_values = self._bind(operation, url_values, kwargs)
+            t = m.phase('params', t)
+
+            cache = getattr(operation, '_cache', None)
+            if cache is not None:
+                key = cache.key(m.operation, url_values, p_values,
+                                self.request)
+                entry = yield cache.fetch(m.operation, key, lambda: (
+                    self._render(operation, p_values, kwargs, res)))
+                t = m.phase('handler', t)
+                http_cache.write_cached(self, m.operation, entry,
+                                        cache.counted)
+                return
+
+            rs = yield self._call(operation, p_values, kwargs)
+            t = m.phase('handler', t)
+
+            stream = as_stream(rs)
+            if stream is not None:
+                yield self._write_stream(*stream)
+                return
+
+            self.response_decorate(rs, res)
+            body = self.codec.dumps(res)
+            t = m.phase('encode', t)
+
+            self.set_header("Content-Type", 'application/json')
+            if not self._finished:
+                self.write(body)
+            else:
+                # 有些情况下需要先finish，这时候应该不需要write，比如下载的时候。
+                LOG.warn('Cannot write() after finish(). boyd:\n %s', body)
+
+        except Exception as detail:
+            # 出错的阶段不计入统计，输出错误信息计入write
+            t = time.time()
+            self.set_header("Content-Type", 'application/json')
+            LOG.debug("rest frame detail=%s" % detail)
+            self.set_status(self._error_status(detail))
+            if isinstance(detail, (Rejected, ServiceBusy)):
+                self.set_header('Retry-After', detail.retry_after)
+            res['success'] = False
+            res['msg'] = '%s' % detail
+            self.write(self.codec.dumps(res))
+        finally:
+            if not self._finished:
+                self.finish()
+            if admitted:
+                admission.release()
+            m.phase('write', t)
+            m.in_flight.dec()
+
+    def _decode_body(self):
+        """ :return: 方法的kwargs，json body在`body`中 """
+        kwargs = {}
+        if self.request.body:
+            if 'application/json' in self.request.headers.get_list(
+                    'content-type'):
+                kwargs['body'] = self.codec.loads(self.request.body)
+        return kwargs
+
+    def _bind(self, operation, url_values, kwargs):
+        binder = getattr(operation, '_binder', None)
+        if binder is not None:
+            return binder.bind(url_values, self.request.arguments,
+                               kwargs.get('body'))
+        return url_values + self._find_params_value_of_arguments(operation)
+
+    @staticmethod
+    def _error_status(detail):
+        """ :return: 出错时响应的状态码，和原来一样默认是200 """
+        if isinstance(detail, ParamError):
+            return 400
+        if isinstance(detail, Rejected):
+            return detail.status_code
+        if isinstance(detail, ServiceBusy):
+            # 过载时每个请求都会出错，不写堆栈
+            return detail.code
+        LOG.error(trace())
+        return 200
+
+    @gen.coroutine
+    def _invoke(self, name, url_values):
+        """
+        执行一个操作，不输出响应，用于`core.batch`。
+        `batch_once`的filter由调用者执行，其他filter对这个操作的请求执行；
+        不使用`cache_ttl`/`coalesce`，方法不能返回流。
+
+        :return: (状态码, 响应的dict)
+        """
+        res = {
+            "success": True,
+            "msg": "",
+            "result": [],
+            "total": 0
+        }
+        operation = getattr(self, name)
+        m = self._metrics = operation_metrics(type(self), name)
+        self.context.operation = m.operation
+        admission = getattr(operation, '_admission', None)
+        admitted = False
+        status = 200
+        m.in_flight.inc()
+        try:
+            if admission is not None:
+                yield admission.admit(self.request)
+                admitted = True
+            yield _filter.run(self.request, batch_once=False)
+            kwargs = self._decode_body()
+            p_values = self._bind(operation, url_values, kwargs)
+            rs = yield self._call(operation, p_values, kwargs)
+            if as_stream(rs) is not None:
+                raise ValueError('Streamed results cannot be used in batch')
+            self.response_decorate(rs, res)
+        except Exception as detail:
+            LOG.debug("rest frame detail=%s" % detail)
+            status = self._error_status(detail)
+            res['success'] = False
+            res['msg'] = '%s' % detail
+        finally:
+            if admitted:
+                admission.release()
+            m.in_flight.dec()
+            m.finished(status, self.request.request_time(), self.context)
+        raise gen.Return((status, res))
+
+    @gen.coroutine
+    def _call(self, operation, p_values, kwargs):
+        rs = yield operation(*p_values, **kwargs)
+        if is_future(rs):
+            # 使用executor时又加了@gen.coroutine
+            rs = yield rs
+        raise gen.Return(rs)
+
+    @gen.coroutine
+    def _render(self, operation, p_values, kwargs, res):
+        """ 执行操作并编码响应，用于缓存 """
+        rs = yield self._call(operation, p_values, kwargs)
+        if as_stream(rs) is not None:
+            raise ValueError(
+                'cache_ttl/coalesce cannot be used with streamed results')
+        self.response_decorate(rs, res)
+        compress = (self.settings.get('compress_response') or
+                    self.settings.get('gzip'))
+        raise gen.Return(http_cache.CachedResponse(
+            utf8(self.codec.dumps(res)), compress))
+
+    @gen.coroutine
+    def _write_stream(self, rows, total=None):
+        """
+        以chunked方式输出响应，每`stream_flush_rows`行flush一次。
+
+        响应头已经发出后无法再改变状态码，出错时在响应体的末尾输出
+        `"success": false`以及错误信息。
+        """
+        flush_rows = self.settings.get('stream_flush_rows', 1000)
+        encode = self.codec.dumps
+        count = 0
+        chunk = []
+
+        self.set_header("Content-Type", 'application/json')
+        if total is None:
+            self.write('{"result": [')
+        else:
+            self.write('{"total": %d, "result": [' % total)
+        try:
+            if hasattr(rows, 'next_batch'):
+                while True:
+                    batch = yield rows.next_batch()
+                    if not batch:
+                        break
+                    for row in batch:
+                        chunk.append(utf8(encode(row)))
+                    count += len(batch)
+                    if len(chunk) >= flush_rows:
+                        yield self._flush_rows(chunk)
+                        chunk = []
+            else:
+                for row in rows:
+                    chunk.append(utf8(encode(row)))
+                    count += 1
+                    if len(chunk) >= flush_rows:
+                        yield self._flush_rows(chunk)
+                        chunk = []
+            self._write_rows(chunk)
+        except StreamClosedError:
+            LOG.warn('Connection closed while streaming %s, %d rows sent.',
+                     self.request.path, count)
+            return
+        except Exception as detail:
+            LOG.error(trace())
+            self._write_rows(chunk)
+            self.write('], "total": %d, "success": false, "msg": %s}' % (
+                count, utf8(encode('%s' % detail))))
+            return
+        finally:
+            if hasattr(rows, 'close'):
+                rows.close()
+
+        if total is None:
+            self.write('], "total": %d, "success": true, "msg": ""}' % count)
+        else:
+            self.write('], "success": true, "msg": ""}')
+
+    def _write_rows(self, chunk):
+        if not chunk:
+            return
+        if self._stream_started:
+            self.write(b',')
+        self.write(b','.join(chunk))
+        self._stream_started = True
+
+    def _flush_rows(self, chunk):
+        self._write_rows(chunk)
+        return self.flush()
 
     @staticmethod
     def response_decorate(rs, res):
@@ -240,31 +626,13 @@ class RestHandler(tornado.web.RequestHandler):
                 res['result'] = [rs]
                 res['total'] = 1
 
-    def _find_params_value_of_url(self, services, url):
-        """ Find the values of path params """
-        values_of_query = list()
-        i = 0
-        url_split = url.split("/")
-        values = [item for item in url_split if
-                  item not in services and item != '']
-        for v in values:
-            if v is not None:
-                values_of_query.append(v)
-                i += 1
-        return values_of_query
-
     def _find_params_value_of_arguments(self, operation):
         values = []
-        if len(self.request.arguments) > 0:
-            a = operation._service_params
-            b = operation._func_params
-            params = [item for item in b if item not in a]
-            for p in params:
-                if p in self.request.arguments.keys():
-                    v = self.request.arguments[p]
-                    values.append(v[0])
-                else:
-                    values.append(None)
+        arguments = self.request.arguments
+        if len(arguments) > 0:
+            for p in operation._arg_params:
+                v = arguments.get(p)
+                values.append(v[0] if v is not None else None)
         elif len(self.request.arguments) == 0 and len(
                 operation._query_params) > 0:
             values = [None] * (
@@ -288,6 +656,21 @@ class RestHandler(tornado.web.RequestHandler):
                 services.append(getattr(o, '_service_name'))
         return services
 
+    @classmethod
+    def route_table(cls):
+        """
+        Gets the route index of the class, it is built once per class.
+        """
+        routes = cls.__dict__.get('_route_table')
+        if routes is None:
+            routes = RouteTable()
+            for f in dir(cls):
+                o = getattr(cls, f)
+                if callable(o) and hasattr(o, '_path'):
+                    routes.add(f, getattr(o, '_method'), getattr(o, '_path'))
+            cls._route_table = routes
+        return routes
+
     @classmethod
     def get_paths(cls):
         """
@@ -301,20 +684,14 @@ class RestHandler(tornado.web.RequestHandler):
         return paths
 
     @classmethod
-    def get_handlers(cls):
-        """ Gets a list with (path, handler) """
+    def get_handlers(cls, resource=None):
+        """ Gets a list with (path, handler, kwargs) """
         svs = []
-        paths = cls.get_paths()
-        for p in paths:
-            s = re.sub(r"(?<={)\w+}", ".*", p).replace("{", "")
-            o = re.sub(
-                r"(?<=<)\w+", "", s
-            ).replace(
-                "<", "").replace(
-                ">", "").replace(
-                "&", "").replace(
-                "?", "")
-            svs.append((o, cls))
+        for pattern, operations, params in cls.route_table().rules():
+            kwargs = dict(resource or {})
+            kwargs['_rest_operations'] = operations
+            kwargs['_rest_params'] = params
+            svs.append((pattern, cls, kwargs))
 
         return svs
 
@@ -327,33 +704,41 @@ class RestService(tornado.web.Application):
                  default_host="", transforms=None, **settings):
         restservices = []
         self.resource = resource
+        self.json_codec = get_codec(settings.get('json_codec', 'json'))
         for r in rest_handlers:
             svs = self._generate_rest_services(r)
             restservices += svs
+        # 不同的RestHandler之间也要保证静态段优先
+        restservices.sort(key=lambda sv: rule_order(sv[0]))
+        # core.batch引用了这个模块，在这里引入
+        from core.batch import batch_handlers
+        restservices = batch_handlers(restservices, settings) + restservices
         if handlers is not None:
             restservices += handlers
         tornado.web.Application.__init__(self, restservices, default_host,
                                          transforms, **settings)
 
     def _generate_rest_services(self, rest):
-        svs = []
-        paths = rest.get_paths()
-        for p in paths:
-            s = re.sub(r"(?<={)\w+}", ".*", p).replace("{", "")
-            o = re.sub(
-                r"(?<=<)\w+", "", s
-            ).replace(
-                "<", ""
-            ).replace(
-                ">", ""
-            ).replace(
-                "&", ""
-            ).replace(
-                "?", ""
-            )
-            svs.append((o, rest, self.resource))
-
-        return svs
+        return rest.get_handlers(self.resource)
+
+
+def as_stream(rs):
+    """
+    判断方法的返回值是否需要以流的方式输出。
+    :return: (rows, total)，不是流时返回None
+    """
+    if _is_row_stream(rs):
+        return rs, None
+    if isinstance(rs, types.TupleType) and len(rs) == 2:
+        if _is_row_stream(rs[0]) and isinstance(rs[1], types.IntType):
+            return rs
+        if _is_row_stream(rs[1]) and isinstance(rs[0], types.IntType):
+            return rs[1], rs[0]
+    return None
+
+
+def _is_row_stream(rs):
+    return isinstance(rs, types.GeneratorType) or hasattr(rs, 'next_batch')
 
 
 def is_standard_rs(rs):
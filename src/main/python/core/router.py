@@ -0,0 +1,149 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块为RestHandler提供路由索引。
+
+每个RestHandler子类在注册时（`RestService._generate_rest_services`）构建一次索引，
+之后`_exe`按HTTP方法和path的形状查找被装饰的方法，不再对`dir(self)`做线性扫描。
+
+索引是按path段组织的前缀树，静态段（如`/vm/list`中的`list`）优先于
+参数段（如`/vm/{id}`中的`{id}`）匹配。
+
+`RouteTable.rules`把索引转换成tornado的路由规则：每一种path形状一条锚定的正则，
+path参数是命名分组，规则上绑定了各HTTP方法对应的操作。这样tornado只路由一次，
+path参数也由tornado提取好。
+
+"""
+import re
+
+__author__ = 'cuigang@easted.com.cn'
+
+_PARAM = re.compile(r"^{(\w+)}$")
+
+
+def split_path(path):
+    """
+    把path拆分成段，忽略query部分以及多余的`/`。
+    :param path: 形如`/vm/{id}/disk?<page>&<size>`的path
+    :return: 段的列表
+    """
+    return [s for s in path.split('?')[0].split('/') if s != '']
+
+
+def compile_path(path):
+    """
+    把装饰器中的`_path`编译成锚定的正则，path参数编译成命名分组。
+    :param path: 形如`/vm/{id}/disk?<page>&<size>`的path
+    :return: (正则字符串, path参数名的列表)
+    """
+    parts = []
+    params = []
+    for s in split_path(path):
+        m = _PARAM.match(s)
+        if m:
+            params.append(m.group(1))
+            parts.append('(?P<%s>[^/]+)' % m.group(1))
+        else:
+            parts.append(re.escape(s))
+    if not parts:
+        return '^/$', params
+    return '^/' + '/'.join(parts) + '/?$', params
+
+
+def rule_order(pattern):
+    """
+    路由规则的排序键：逐段比较，静态段排在参数段前面。
+    :param pattern: `compile_path`生成的正则字符串
+    """
+    return [1 if s.startswith('(?P<') else 0 for s in pattern.split('/')[1:]]
+
+
+class _Node(object):
+    __slots__ = ('static', 'param', 'operations')
+
+    def __init__(self):
+        self.static = {}
+        self.param = None
+        self.operations = {}
+
+
+class RouteTable(object):
+    """
+    一个RestHandler子类的路由索引，是一棵按path段组织的前缀树。
+    查找只和请求path的段数有关，与操作的数量无关。
+    """
+
+    def __init__(self):
+        self.methods = set()
+        self._root = _Node()
+        self._paths = []
+
+    def add(self, name, method, path):
+        """
+        :param name: 被装饰方法的名字
+        :param method: HTTP方法
+        :param path: 装饰器中的`_path`
+        """
+        node = self._root
+        params = []
+        for s in split_path(path):
+            m = _PARAM.match(s)
+            if m:
+                params.append(m.group(1))
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+            else:
+                node = node.static.setdefault(s, _Node())
+        self.methods.add(method)
+        if method not in node.operations:
+            node.operations[method] = (name, params)
+            self._paths.append((name, method, path))
+
+    def rules(self):
+        """
+        生成tornado的路由规则，同一种path形状的操作共用一条规则。
+        规则按静态段优先排序，以保证和`match`的结果一致。
+        静态段的规则中没有的方法，由`RestHandler._exe`通过`match`查找参数段的操作。
+        :return: [(正则字符串, {HTTP方法: 方法名}, path参数名的列表)]
+        """
+        shapes = {}
+        for name, method, path in self._paths:
+            shape = tuple(
+                None if _PARAM.match(s) else s for s in split_path(path))
+            if shape not in shapes:
+                pattern, params = compile_path(path)
+                shapes[shape] = (pattern, {}, params)
+            shapes[shape][1].setdefault(method, name)
+        return sorted(shapes.values(), key=lambda r: rule_order(r[0]))
+
+    def match(self, method, path):
+        """
+        :param method: HTTP方法
+        :param path: 请求的path
+        :return: (方法名, path参数值的列表)，没有匹配时返回None
+        """
+        values = []
+        found = self._match(self._root, split_path(path), 0, method, values)
+        if found is None:
+            return None
+        return found[0], values
+
+    def _match(self, node, segments, i, method, values):
+        if i == len(segments):
+            return node.operations.get(method)
+        # 静态段优先，匹配不到时再尝试参数段
+        child = node.static.get(segments[i])
+        if child is not None:
+            found = self._match(child, segments, i + 1, method, values)
+            if found is not None:
+                return found
+        if node.param is not None:
+            values.append(segments[i])
+            found = self._match(node.param, segments, i + 1, method, values)
+            if found is not None:
+                return found
+            values.pop()
+        return None
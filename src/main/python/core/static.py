@@ -0,0 +1,196 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块提供静态文件的服务，代替`tornado.web.StaticFileHandler`：
+
+- 启动时（或者构建时运行`python -m core.static <目录>`）把文本类的文件预先压缩成
+  `.gz`，安装了brotli时同时生成`.br`；请求时按`Accept-Encoding`直接输出压缩后的文件，
+  tornado不再每次压缩；
+- 小文件（默认64KB以下）缓存在内存中，按修改时间和大小检查是否变化；
+  大文件仍然按64KB分块读取和输出，内存占用有上限；
+- 带有内容hash的url（`versioned_url`生成，`?v=<hash>`）返回
+  `Cache-Control: public, max-age=..., immutable`。
+
+```python
+handlers = [
+    (r"/web/(.*)", PrecompressedStaticFileHandler, {"path": web_root}),
+]
+```
+
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import sys
+from io import BytesIO
+
+from tornado import web
+
+from core.cache import LRUCache
+
+__author__ = 'cuigang@easted.com.cn'
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOG = logging.getLogger('system')
+
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/x-javascript',
+                      'application/json', 'application/xml', 'image/svg+xml')
+
+# 内存中缓存的小文件，key是绝对路径
+_memory = LRUCache(max_size=32 * 1024 * 1024)
+
+
+def _gzip(data):
+    buf = BytesIO()
+    f = gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=9, mtime=0)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+def _encoders():
+    """ :return: [(扩展名, Content-Encoding, 压缩函数)]，按优先顺序 """
+    rs = []
+    if brotli is not None:
+        rs.append(('.br', 'br', brotli.compress))
+    rs.append(('.gz', 'gzip', _gzip))
+    return rs
+
+
+def is_compressible(path):
+    mime_type, encoding = mimetypes.guess_type(path)
+    if encoding is not None or mime_type is None:
+        return False
+    return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+
+
+def precompress(root, min_size=256):
+    """
+    为root下文本类的文件生成压缩后的文件，已经存在且不比原文件旧的跳过。
+
+    :param min_size: 小于这个大小的文件不压缩
+    :return: 生成的文件数
+    """
+    count = 0
+    for dir_path, dir_names, file_names in os.walk(root):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            if not is_compressible(path):
+                continue
+            st = os.stat(path)
+            if st.st_size < min_size:
+                continue
+            data = None
+            for ext, encoding, compress in _encoders():
+                target = path + ext
+                if (os.path.exists(target) and
+                        os.stat(target).st_mtime >= st.st_mtime):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                # 先写临时文件再改名，多个进程同时压缩时也不会读到不完整的文件
+                tmp = '%s.%d.tmp' % (target, os.getpid())
+                try:
+                    with open(tmp, 'wb') as f:
+                        f.write(compressed)
+                    os.rename(tmp, target)
+                    count += 1
+                except (IOError, OSError) as e:
+                    LOG.warn('Cannot write %s: %s', target, e)
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+    return count
+
+
+class PrecompressedStaticFileHandler(web.StaticFileHandler):
+    # 小于等于这个大小的文件缓存在内存中
+    small_file_size = 64 * 1024
+
+    def initialize(self, path, default_filename=None):
+        super(PrecompressedStaticFileHandler, self).initialize(
+            path, default_filename)
+        self.content_encoding = None
+        self.original_path = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(
+            PrecompressedStaticFileHandler, self).validate_absolute_path(
+            root, absolute_path)
+        if absolute_path is None or not is_compressible(absolute_path):
+            return absolute_path
+        self.original_path = absolute_path
+        accepted = self.request.headers.get('Accept-Encoding', '')
+        mtime = None
+        for ext, encoding, compress in _encoders():
+            if encoding not in accepted:
+                continue
+            variant = absolute_path + ext
+            try:
+                if mtime is None:
+                    mtime = os.stat(absolute_path).st_mtime
+                if os.stat(variant).st_mtime >= mtime:
+                    self.content_encoding = encoding
+                    return variant
+            except OSError:
+                pass
+        return absolute_path
+
+    def get_content_type(self):
+        if self.content_encoding is None:
+            return super(PrecompressedStaticFileHandler,
+                         self).get_content_type()
+        mime_type, encoding = mimetypes.guess_type(self.original_path)
+        return mime_type
+
+    def set_extra_headers(self, path):
+        if self.original_path is not None and not (
+                self.settings.get('compress_response') or
+                self.settings.get('gzip')):
+            # 开启了gzip时由tornado的GZipContentEncoding设置Vary
+            self.set_header('Vary', 'Accept-Encoding')
+        if self.content_encoding is not None:
+            # 已经有Content-Encoding时tornado不再压缩
+            self.set_header('Content-Encoding', self.content_encoding)
+        if 'v' in self.request.arguments:
+            self.set_header('Cache-Control', 'public, max-age=%d, immutable' %
+                            self.CACHE_MAX_AGE)
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        st = os.stat(abspath)
+        if st.st_size > cls.small_file_size:
+            return super(PrecompressedStaticFileHandler, cls).get_content(
+                abspath, start, end)
+        item = _memory.get(abspath)
+        if item is None or item[0] != (st.st_mtime, st.st_size):
+            with open(abspath, 'rb') as f:
+                data = f.read()
+            item = ((st.st_mtime, st.st_size), data)
+            _memory.set(abspath, item, 86400 * 365, size=len(data))
+        return item[1][start:end]
+
+    @classmethod
+    def versioned_url(cls, root, path, prefix='/web/'):
+        """
+        :return: 带有内容hash的url，例如`/web/app.js?v=0f3c...`
+        """
+        version = cls._get_cached_version(cls.get_absolute_path(root, path))
+        if not version:
+            return prefix + path
+        return '%s%s?v=%s' % (prefix, path, version)
+
+
+if __name__ == '__main__':
+    for d in sys.argv[1:]:
+        print('%s: %d files compressed' % (d, precompress(d)))
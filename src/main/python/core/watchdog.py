@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+说明
+---
+
+此模块检测IOLoop被阻塞的情况。
+
+- IOLoop中每`interval`秒执行一次心跳，记录实际执行时间比预定时间晚了多少（loop lag）；
+- 后台线程检查心跳，超过`threshold`秒没有心跳时，说明有回调阻塞了IOLoop，
+  取得IOLoop线程的堆栈，连同正在处理的操作（`类名.方法名`）写入日志；
+- 阻塞结束后再记录一次阻塞的时间。
+
+统计通过`/metrics`输出：
+
+- `ioloop_lag_seconds`：最近的lag的分位数（summary）；
+- `ioloop_blocked_total`、`ioloop_blocked_seconds`：按操作统计的阻塞次数和时间。
+
+```python
+watchdog.start(threshold=0.5)
+```
+
+"""
+import logging
+import sys
+import thread
+import threading
+import time
+import traceback
+from collections import deque
+
+from tornado.ioloop import IOLoop
+
+from core import context, metrics
+
+__author__ = 'cuigang@easted.com.cn'
+
+LOG = logging.getLogger('system')
+
+QUANTILES = (0.5, 0.9, 0.99, 1)
+
+_blocked_total = metrics.counter(
+    'ioloop_blocked_total', 'Times the IOLoop was blocked over the threshold.',
+    ('operation',))
+_blocked_seconds = metrics.histogram(
+    'ioloop_blocked_seconds', 'Duration of IOLoop blocks over the threshold.',
+    ('operation',))
+
+
+class Watchdog(object):
+    """
+    :param interval: 心跳的间隔（秒）
+    :param threshold: 超过多少秒没有心跳认为IOLoop被阻塞
+    :param window: 计算lag分位数使用的最近的心跳数
+    """
+
+    def __init__(self, io_loop=None, interval=0.1, threshold=0.5, window=1000):
+        self.io_loop = io_loop or IOLoop.current()
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=window)
+        self.beat = time.time()
+        self.thread_id = None
+        self._expected = None
+        self._handle = None
+        self._running = False
+        self._reported = None
+        self._blocked = None
+
+    def start(self):
+        """ 在IOLoop线程中调用 """
+        self.thread_id = thread.get_ident()
+        self._running = True
+        self.beat = time.time()
+        self._tick()
+        watcher = threading.Thread(target=self._watch, name='ioloop-watchdog')
+        watcher.daemon = True
+        watcher.start()
+
+    def stop(self):
+        self._running = False
+        if self._handle is not None:
+            self.io_loop.remove_timeout(self._handle)
+            self._handle = None
+
+    def _tick(self):
+        now = self.io_loop.time()
+        if self._expected is not None:
+            self.lags.append(max(0.0, now - self._expected))
+        last = self.beat
+        self.beat = time.time()
+        if self._blocked is not None:
+            operation = self._blocked
+            self._blocked = None
+            duration = self.beat - last
+            _blocked_total.labels(operation).inc()
+            _blocked_seconds.labels(operation).observe(duration)
+            LOG.warn('IOLoop was blocked for %.3fs in %s', duration, operation)
+        self._expected = now + self.interval
+        self._handle = self.io_loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        check = max(0.01, min(self.interval, self.threshold / 2.0))
+        while self._running:
+            time.sleep(check)
+            beat = self.beat
+            blocked = time.time() - beat
+            if blocked < self.threshold or beat == self._reported:
+                continue
+            self._reported = beat
+            frame = sys._current_frames().get(self.thread_id)
+            ctx = context.context_of(self.thread_id)
+            operation = '(none)'
+            if ctx is not None and ctx.operation is not None:
+                operation = ctx.operation
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            # 统计在IOLoop恢复后由心跳更新
+            self._blocked = operation
+            LOG.warn('IOLoop blocked for %.3fs in %s:\n%s',
+                     blocked, operation, stack)
+
+    def quantiles(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return [(q, 0.0) for q in QUANTILES]
+        return [(q, lags[min(len(lags) - 1, int(q * len(lags)))])
+                for q in QUANTILES]
+
+    def collect(self):
+        samples = [('', [('quantile', q)], v) for q, v in self.quantiles()]
+        samples.append(('_sum', [], sum(self.lags)))
+        samples.append(('_count', [], len(self.lags)))
+        return [('ioloop_lag_seconds', 'summary',
+                 'How late the IOLoop heartbeat ran, over the recent '
+                 'heartbeats.', samples)]
+
+
+def start(interval=0.1, threshold=0.5):
+    """
+    启动当前IOLoop的watchdog，并注册lag的统计。
+    """
+    watchdog = Watchdog(interval=interval, threshold=threshold)
+    watchdog.start()
+    metrics.add_collector(watchdog.collect)
+    return watchdog
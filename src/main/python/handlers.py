@@ -1,7 +1,13 @@
 from tornado import web
 
+from core.metrics import MetricsHandler
+from core.profiler import ProfilerHandler
+from core.static import PrecompressedStaticFileHandler
+
 web_root = '../web'
 handlers = [
-    (r"/web/(.*)", web.StaticFileHandler, {"path": web_root}),
+    (r"/web/(.*)", PrecompressedStaticFileHandler, {"path": web_root}),
     (r"/", web.RedirectHandler, dict(url=r"/web/login.html")),
+    (r"/metrics", MetricsHandler),
+    (r"/admin/profiler/?(sampler|profiles)?", ProfilerHandler),
 ]
@@ -6,16 +6,42 @@ import sys
 
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
+from tornado.options import define, options, parse_command_line
 
 import logger
+from core import db_utils
+from core import prefork
 from core import rest
-from handlers import handlers
+from core import static
+from core import watchdog
+from handlers import handlers, web_root
+
+define('port', default=8888, help='listen port')
+define('production', default=False,
+       help='run with multiple worker processes, debug and autoreload off')
+define('workers', default=0,
+       help='number of worker processes in production, 0 means cpu count')
+define('drain_timeout', default=10,
+       help='seconds to wait for in-flight requests when a worker stops')
+define('db_config', default='',
+       help='file of the database pool settings, see '
+            'core.db_utils.load_pool_config')
+define('watchdog_threshold', default=0.5,
+       help='log the stack when the IOLoop is blocked for longer than '
+            'this many seconds, 0 to disable')
+
+parse_command_line()
 
 logging.config.dictConfig(logger.ecloud_config.get_dict_config())
 
 LOG = logging.getLogger('system')
 
-try:
+# 在创建连接池之前读取配置
+if options.db_config:
+    db_utils.load_pool_config(options.db_config)
+
+
+def make_application():
     service_modules_name = [_.split('.')[0] for _ in os.listdir('./ws')
                             if _.split('.')[0] != '__init__']
 
@@ -27,23 +53,62 @@ try:
         modules.append(getattr(ws_module, 'Service'))
 
     settings = {
-        'debug': 'DEBUG',
         'gzip': True,
-        'autoreload': True,
-        'autoescape': None
+        'autoescape': None,
+        'json_codec': 'auto'
     }
+    if not options.production:
+        settings['debug'] = 'DEBUG'
+        settings['autoreload'] = True
     application = rest.RestService(modules, **settings)
 
     application.add_handlers(r".*", handlers)
 
-    server = HTTPServer(application)
+    return application
+
+
+def start_watchdog():
+    if options.watchdog_threshold > 0:
+        watchdog.start(threshold=options.watchdog_threshold)
+
+
+def start_worker(task_id, sockets):
+    # fork之后写日志的线程不存在了，重新配置
+    logging.config.dictConfig(logger.ecloud_config.get_dict_config())
+
+    server = HTTPServer(make_application())
+    server.add_sockets(sockets)
+    prefork.install_drain(server, rest.in_flight_requests,
+                          options.drain_timeout)
+
+    start_watchdog()
+
+    LOG.debug('--worker %d start---', task_id)
+    IOLoop.current().start()
+    LOG.debug('--worker %d stopped---', task_id)
+
+
+try:
+    # 在fork之前压缩静态文件，worker直接使用
+    static.precompress(web_root)
+
+    if options.production:
+        LOG.debug('--service start---')
+        prefork.run(start_worker, options.port, options.workers)
+        LOG.debug('--service stopped---')
+    else:
+        server = HTTPServer(make_application())
 
-    LOG.debug('--service start---')
-    server.bind(8888)
-    server.start()
+        LOG.debug('--service start---')
+        server.bind(options.port)
+        server.start()
+        start_watchdog()
 
-    IOLoop.instance().start()
+        IOLoop.instance().start()
 
+except prefork.CrashLoop as e:
+    LOG.error('service stopped: %s', e)
+    sys.exit(1)
 except KeyboardInterrupt:
     print  # 特意保留一个空行，以便和之前的输出区分
     print "Stop the easted service..."
@@ -1,4 +1,5 @@
-from core.logger import TimedRotatingFileHandler, SystemFormat
+# coding=utf-8
+from core.logger import SharedTimedRotatingFileHandler, SystemFormat
 from core.logger_base import LoggerConfig, Loggers
 
 __all__ = [
@@ -13,9 +14,10 @@ class SystemLogger(Loggers):
     pass
 
 
-class EcloudHandler(TimedRotatingFileHandler):
+class EcloudHandler(SharedTimedRotatingFileHandler):
     def __init__(self):
         super(EcloudHandler, self).__init__()
+        # 多进程时主进程和所有worker写同一个文件
         self.filename = '%s/tornado_%s.log' % (
             log_dir, region_name
         )
@@ -28,7 +30,7 @@ class WebLogConfig(LoggerConfig):
         self.system_format = SystemFormat()
 
 
-ecloud_config = WebLogConfig()
+ecloud_config = WebLogConfig().use_queue()
 ecloud_config.add_handler(
     EcloudHandler(),
     ecloud_config.system,